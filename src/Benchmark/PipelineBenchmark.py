@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+from PIL import Image
+
+from Model.ImageAnalysis import AutoAnalysis
+from Model.ImageAnalysis.StageTimer import StageTimer
+from Model.ImageAnalysis.CircleGeometry import DEFAULT_DIAMETER
+from .SyntheticImages import make_edge_image
+
+"""
+ Times each stage of the auto detection pipeline and process_image end to end on synthetic edge images
+ with known angle, contrast and blur, and checks the measurements against that ground truth.
+     cd src
+     python -m Benchmark.PipelineBenchmark --output benchmark.json
+"""
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (3840, 2160)]
+EDGES = [
+    # (angle in degrees, contrast, Gaussian blur sigma in pixels)
+    (30.0, 0.4, 1.5),
+    (75.0, 0.2, 3.0),
+    (140.0, 0.6, 5.0),
+]
+
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def summarize_durations(durations):
+    return {
+        'median_s': float(np.median(durations)),
+        'mean_s': float(np.mean(durations)),
+        'min_s': float(np.min(durations)),
+        'max_s': float(np.max(durations)),
+    }
+
+
+def format_value(value, format_spec):
+    return "n/a" if value is None else format(value, format_spec)
+
+
+def angle_error(measured, expected):
+    # Only the orientation of the edge is known from the image, so compare modulo 180 degrees
+    difference = (measured - expected) % 180
+    return float(min(difference, 180 - difference))
+
+
+def time_stages(image_path, diameter, options):
+    timer = StageTimer()
+    AutoAnalysis.process_image(image_path, diameter, timer=timer, **options)
+    return timer.durations
+
+
+def benchmark_case(image_path, width, height, angle, contrast, sigma, repeats, diameter, options):
+    stage_durations = dict()
+    end_to_end_durations = []
+    measured = None
+    for _ in range(repeats):
+        for stage, duration in time_stages(image_path, diameter, options).items():
+            stage_durations.setdefault(stage, []).append(duration)
+
+        measured, duration = time_call(AutoAnalysis.process_image, image_path, diameter, **options)
+        end_to_end_durations.append(duration)
+
+    # Tracing allocations slows everything down, so memory is measured on a separate, untimed run
+    tracemalloc.start()
+    AutoAnalysis.process_image(image_path, diameter, **options)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    measured_angle = None
+    if measured is not None:
+        _, _, measured_angle, measured_contrast, measured_blurriness, _ = measured
+    accuracy = {'line_detected': measured_angle is not None}
+    if measured_angle is not None:
+        accuracy.update({
+            'angle_deg': float(measured_angle),
+            'angle_error_deg': angle_error(measured_angle, angle),
+            'contrast': float(measured_contrast),
+            'contrast_error': float(abs(measured_contrast - contrast)),
+            'edge_fit_failed': bool(np.isnan(measured_blurriness)),
+            'blurriness': float(measured_blurriness),
+            'blurriness_error': float(abs(measured_blurriness - sigma)),
+        })
+
+    end_to_end = summarize_durations(end_to_end_durations) if end_to_end_durations else None
+    return {
+        'resolution': [width, height],
+        'ground_truth': {'angle_deg': angle, 'contrast': contrast, 'sigma': sigma},
+        'options': options,
+        'stages': {stage: summarize_durations(durations) for stage, durations in stage_durations.items()},
+        'end_to_end': end_to_end,
+        'throughput_images_per_s': 1 / end_to_end['median_s'] if end_to_end else 0.0,
+        'peak_memory_bytes': peak_memory,
+        'accuracy': accuracy,
+    }
+
+
+def run_benchmark(resolutions, edges, repeats, diameter, variants, noise):
+    cases = []
+    with tempfile.TemporaryDirectory() as directory:
+        for width, height in resolutions:
+            for angle, contrast, sigma in edges:
+                image = make_edge_image(width, height, angle, contrast, sigma, noise=noise)
+                image_path = os.path.join(directory, f"edge_{width}x{height}_{angle:g}.jpg")
+                Image.fromarray(image).save(image_path, quality=95)
+                for options in variants:
+                    case = benchmark_case(image_path, width, height, angle, contrast, sigma, repeats, diameter, options)
+                    cases.append(case)
+                    print(f"{width}x{height} angle={angle:g} contrast={contrast:g} sigma={sigma:g} "
+                          f"{options['detection_mode']}/{options['segmentation']}: "
+                          f"{case['throughput_images_per_s']:.2f} images/s, "
+                          f"angle error {case['accuracy'].get('angle_error_deg', float('nan')):.3f} deg", flush=True)
+    return cases
+
+
+def compare_against_baseline(cases, option, baseline_value):
+    # Pairs every case with the run on the same image that differs only in this option
+    def pairing_key(case):
+        other_options = tuple(sorted((key, value) for key, value in case['options'].items() if key != option))
+        return tuple(case['resolution']), case['ground_truth']['angle_deg'], other_options
+
+    baselines = {pairing_key(case): case for case in cases if case['options'][option] == baseline_value}
+    comparison = []
+    for case in cases:
+        baseline = baselines.get(pairing_key(case))
+        if baseline is None or case is baseline:
+            continue
+        speedup = None
+        if case['end_to_end'] and baseline['end_to_end']:
+            speedup = baseline['end_to_end']['median_s'] / case['end_to_end']['median_s']
+        angle_agreement = None
+        if 'angle_deg' in case['accuracy'] and 'angle_deg' in baseline['accuracy']:
+            angle_agreement = angle_error(case['accuracy']['angle_deg'], baseline['accuracy']['angle_deg'])
+        comparison.append({
+            'resolution': case['resolution'],
+            'ground_truth': case['ground_truth'],
+            'options': case['options'],
+            'baseline': {option: baseline_value},
+            'speedup': speedup,
+            'angle_error_deg': case['accuracy'].get('angle_error_deg'),
+            'baseline_angle_error_deg': baseline['accuracy'].get('angle_error_deg'),
+            'angle_difference_to_baseline_deg': angle_agreement,
+        })
+    return comparison
+
+
+def print_comparison(comparison, option):
+    for entry in comparison:
+        width, height = entry['resolution']
+        print(f"{width}x{height} angle={entry['ground_truth']['angle_deg']:g} "
+              f"{entry['options'][option]} vs {entry['baseline'][option]} "
+              f"({entry['options']['detection_mode']}/{entry['options']['segmentation']}): "
+              f"{format_value(entry['speedup'], '.2f')}x speedup, "
+              f"angle error {format_value(entry['angle_error_deg'], '.4f')} vs "
+              f"{format_value(entry['baseline_angle_error_deg'], '.4f')} deg, "
+              f"angles differ by {format_value(entry['angle_difference_to_baseline_deg'], '.4f')} deg")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Benchmark.PipelineBenchmark",
+                                     description="Benchmark the image analysis pipeline on synthetic images.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file the results are written to")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per image (default: %(default)s)")
+    parser.add_argument("--diameter", type=int, default=DEFAULT_DIAMETER, help="analysis circle diameter (default: %(default)s)")
+    parser.add_argument("--noise", type=float, default=2.0,
+                        help="standard deviation of additive Gaussian noise (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help="only run the smallest resolution")
+    parser.add_argument("--legacy-kmeans", action="store_true",
+                        help="use the original per-pixel k-means implementation")
+    parser.add_argument("--detection-modes", nargs="+", choices=AutoAnalysis.DETECTION_MODES,
+                        default=list(AutoAnalysis.DETECTION_MODES),
+                        help="line detectors to run; each is compared against standard (default: all)")
+    parser.add_argument("--segmentation-backends", nargs="+", choices=AutoAnalysis.SEGMENTATION_BACKENDS,
+                        default=list(AutoAnalysis.SEGMENTATION_BACKENDS),
+                        help="segmentation backends to run; each is compared against kmeans (default: all)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    resolutions = RESOLUTIONS[:1] if arguments.quick else RESOLUTIONS
+    variants = [
+        {'vectorized_kmeans': not arguments.legacy_kmeans, 'detection_mode': detection_mode,
+         'segmentation': segmentation}
+        for detection_mode in arguments.detection_modes
+        for segmentation in arguments.segmentation_backends
+    ]
+
+    cases = run_benchmark(resolutions, EDGES, arguments.repeats, arguments.diameter, variants, arguments.noise)
+    comparisons = {
+        'detection_mode': compare_against_baseline(cases, 'detection_mode', "standard"),
+        'segmentation': compare_against_baseline(cases, 'segmentation', "kmeans"),
+    }
+    for option, comparison in comparisons.items():
+        print_comparison(comparison, option)
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'repeats': arguments.repeats,
+        'diameter': arguments.diameter,
+        'noise': arguments.noise,
+        'cases': cases,
+        'comparisons': comparisons,
+    }
+    with open(arguments.output, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"Wrote {arguments.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
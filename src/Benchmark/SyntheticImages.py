@@ -0,0 +1,31 @@
+import numpy as np
+from scipy.special import erf
+
+"""
+ Synthetic circular-sample images: a straight edge through the image centre between two flat regions,
+ blurred with a Gaussian point spread function of known sigma.
+ The angle is measured counter-clockwise from the x axis with y pointing up, which is how the
+ analysis reports it (modulo 180 degrees).
+"""
+
+
+def make_edge_image(width, height, angle, contrast, sigma, mean_intensity=128, noise=0.0, seed=0):
+    mid_x, mid_y = width // 2, height // 2
+    theta = np.deg2rad(angle)
+    rows, cols = np.ogrid[:height, :width]
+    # Signed distance from the edge; image rows grow downwards, hence the sign of the row term
+    distance = (cols - mid_x) * np.sin(theta) + (rows - mid_y) * np.cos(theta)
+
+    darker = mean_intensity * (1 - contrast)
+    lighter = mean_intensity * (1 + contrast)
+    if sigma > 0:
+        # Integrating a step against a Gaussian PSF gives an erf profile across the edge
+        profile = 0.5 * (1 + erf(distance / (sigma * np.sqrt(2))))
+    else:
+        profile = (distance >= 0).astype(np.float64)
+    image = darker + (lighter - darker) * profile
+
+    if noise > 0:
+        image = image + np.random.default_rng(seed).normal(0, noise, image.shape)
+
+    return np.clip(np.round(image), 0, 255).astype(np.uint8)
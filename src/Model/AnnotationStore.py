@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import threading
+
+# One JSON object per line, only ever appended; the last line for a file wins. A drawn line is stored as its two
+# endpoints and the "Object is Lighter" flag, a detected one as the Hough (rho, theta) relative to the circle crop
+# of the given diameter, with the ranked candidates it was chosen from as (rho, theta, votes, score) when known
+ANNOTATIONS_FILE = "annotations.jsonl"
+
+
+def get_annotation_store_path(output_processed_folder):
+    return os.path.join(output_processed_folder, ANNOTATIONS_FILE)
+
+
+def make_drawn_annotation(line_points, is_object_lighter):
+    return {'line_points': [list(point) for point in line_points], 'is_object_lighter': bool(is_object_lighter)}
+
+
+def make_detected_annotation(detected_line, diameter, line_candidates=None):
+    rho, theta = detected_line
+    annotation = {'rho': rho, 'theta': theta, 'diameter': diameter}
+    if line_candidates:
+        annotation['candidates'] = [list(candidate) for candidate in line_candidates]
+    return annotation
+
+
+class AnnotationStore:
+    def __init__(self, path, flush_interval=2.0, flush_lines=256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_lines = flush_lines
+        # auto_detection records lines on a worker thread while drawn lines are analysed on another
+        self.lock = threading.Lock()
+        self.drawn = dict()
+        self.detected = dict()
+        self.line_count = 0
+        self.pending_lines = []
+        self.last_flush = time.monotonic()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        # A line without its trailing newline was cut off by a crash and is dropped
+        complete_length = content.rfind(b'\n') + 1
+        if complete_length < len(content):
+            with open(self.path, 'r+b') as file:
+                file.truncate(complete_length)
+        for line in content[:complete_length].decode('utf-8').splitlines():
+            self.apply(json.loads(line))
+            self.line_count += 1
+
+    def apply(self, record):
+        annotation = {key: value for key, value in record.items() if key != 'file'}
+        if 'line_points' in annotation:
+            self.drawn[record['file']] = annotation
+        else:
+            self.detected[record['file']] = annotation
+
+    def append(self, filename, annotation, flush=False):
+        record = {'file': filename, **annotation}
+        with self.lock:
+            self.apply(record)
+            self.pending_lines.append(json.dumps(record))
+            if (flush or len(self.pending_lines) >= self.flush_lines
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.write_pending()
+
+    def append_drawn_line(self, filename, line_points, is_object_lighter):
+        # Drawn lines take a person's time, so they are written to disk straight away
+        self.append(filename, make_drawn_annotation(line_points, is_object_lighter), flush=True)
+
+    def append_detected_line(self, filename, detected_line, diameter, line_candidates=None):
+        self.append(filename, make_detected_annotation(detected_line, diameter, line_candidates))
+
+    def get_line_candidates(self, filename):
+        # The ranked lines of the last detection, best first, so another one can be picked without detecting again
+        with self.lock:
+            annotation = self.detected.get(filename)
+        if annotation is None:
+            return []
+        return [tuple(candidate) for candidate in annotation.get('candidates', [])]
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self):
+        self.last_flush = time.monotonic()
+        if not self.pending_lines:
+            return
+
+        with open(self.path, 'a', encoding='utf-8', newline='\n') as file:
+            file.write("".join(f"{line}\n" for line in self.pending_lines))
+        self.line_count += len(self.pending_lines)
+        self.pending_lines = []
+
+    def get_annotations(self, filenames=None):
+        # (filename, line, is_object_lighter) for ManualAnalysis; a drawn line is preferred over a detected one
+        with self.lock:
+            drawn, detected = dict(self.drawn), dict(self.detected)
+        annotations = []
+        for filename in dict.fromkeys([*detected, *drawn]):
+            if filenames is not None and filename not in filenames:
+                continue
+            if filename in drawn:
+                annotation = drawn[filename]
+                annotations.append((filename, annotation['line_points'], annotation['is_object_lighter']))
+            else:
+                annotations.append((filename, detected[filename], False))
+        return annotations
+
+    def compact(self):
+        # Rewrites the file with the last drawn and detected line per file, swapped in only once fully written
+        with self.lock:
+            self.write_pending()
+            live_count = len(self.drawn) + len(self.detected)
+            if live_count * 2 >= self.line_count:
+                return
+
+            compacting_path = f"{self.path}.compact"
+            with open(compacting_path, 'w', encoding='utf-8', newline='\n') as file:
+                for annotations in (self.detected, self.drawn):
+                    for filename, annotation in annotations.items():
+                        file.write(f"{json.dumps({'file': filename, **annotation})}\n")
+            os.replace(compacting_path, self.path)
+            self.line_count = live_count
+
+    def close(self):
+        self.flush()
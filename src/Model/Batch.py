@@ -0,0 +1,323 @@
+import os
+import sys
+import math
+import argparse
+import traceback
+from pathlib import Path
+
+from .ImageAnalysis.AutoAnalysis import (
+    auto_detection, get_last_segment_of_path, get_line_scoring, get_processed_image_path, resolve_worker_count,
+    list_image_files, DETECTION_MODES, SEGMENTATION_BACKENDS
+)
+from .ImageAnalysis.ManualAnalysis import reanalyse_annotations
+from .ImageAnalysis.OverlayWriter import OverlayWriter
+from .ImageAnalysis.StageTimer import RunTimings
+from .Export import (
+    export_to_csv, export_to_excel, export_to_mat, iter_analysis_rows, CsvStreamWriter, ANALYSIS_FIELDS
+)
+from .ResultCache import ResultCache
+from .ResultStore import ResultStore, get_result_store_directory
+from .AnnotationStore import AnnotationStore, get_annotation_store_path
+from .FileIndex import iter_image_folders
+from .Settings import Settings
+
+"""
+ Headless batch runner, usable without a display:
+     cd src
+     python -m Model.Batch FOLDER [FOLDER ...] --workers 16 --formats csv mat --output results/
+"""
+
+EXPORTERS = {
+    'csv': (export_to_csv, "csv"),
+    'excel': (export_to_excel, "xlsx"),
+    'mat': (export_to_mat, "mat"),
+}
+
+
+def parse_arguments(argv=None):
+    defaults = Settings.DEFAULT_VALUES
+    parser = argparse.ArgumentParser(prog="python -m Model.Batch",
+                                     description="Run auto detection on image folders without the GUI.")
+    parser.add_argument("folders", nargs="+", help="folders containing the images to analyse")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also analyse every folder below each FOLDER that holds images, each as its own batch "
+                             "named after its path, e.g. run1_cam0_analysis.csv")
+    parser.add_argument("--workers", type=int, default=defaults["auto_detection_workers"],
+                        help="worker processes, 0 for one per CPU (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=defaults["auto_detection_chunk_size"],
+                        help="images per task submitted to a worker (default: %(default)s)")
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXPORTERS), default=["csv"],
+                        help="export formats (default: csv)")
+    parser.add_argument("--output", default=defaults["analysis_export_path"],
+                        help="directory the analysis files are written to (default: %(default)s)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="reuse and update the result cache in this directory")
+    parser.add_argument("--no-overlays", action="store_true",
+                        help="do not write the _processed.jpg overlay images")
+    parser.add_argument("--jpeg-quality", type=int, default=defaults["overlay_jpeg_quality"],
+                        help="JPEG quality of the overlay images (default: %(default)s)")
+    parser.add_argument("--legacy-kmeans", action="store_true",
+                        help="use the original per-pixel k-means implementation")
+    parser.add_argument("--detection-mode", choices=DETECTION_MODES, default=defaults["detection_mode"],
+                        help="line detector; multiscale refines a coarse detection at full resolution "
+                             "(default: %(default)s)")
+    parser.add_argument("--segmentation", choices=SEGMENTATION_BACKENDS, default=defaults["segmentation_backend"],
+                        help="segmentation backend used before edge detection (default: %(default)s)")
+    parser.add_argument("--diameter", type=int, default=defaults["circle_diameter"],
+                        help="diameter in pixels of the centred circle that is analysed (default: %(default)s)")
+    parser.add_argument("--fit-max-iterations", type=int, default=defaults["edge_fit_max_iterations"],
+                        help="cap on model evaluations per blurriness fit, 0 to run until it converges "
+                             "(default: %(default)s)")
+    parser.add_argument("--fit-warm-start", action="store_true",
+                        help="start each blurriness fit from the previous image's fit; results then depend on the "
+                             "processing order, chunk size and worker count")
+    parser.add_argument("--line-vote-weight", type=float, default=defaults["line_vote_weight"],
+                        help="pixels of distance to the centre the Hough line with the most votes is worth "
+                             "(default: %(default)s)")
+    parser.add_argument("--line-angle-prior", type=float, default=defaults["line_angle_prior"],
+                        help="expected edge angle in degrees, used with --line-angle-weight")
+    parser.add_argument("--line-angle-weight", type=float, default=defaults["line_angle_weight"],
+                        help="pixels of distance to the centre each degree away from --line-angle-prior costs "
+                             "(default: %(default)s)")
+    parser.add_argument("--replay", action="store_true",
+                        help="compute the metrics again from the folder's stored drawn and detected lines "
+                             "instead of detecting lines")
+    parser.add_argument("--no-store", action="store_true",
+                        help="do not append the results and lines to the folder's result and annotation stores")
+    parser.add_argument("--profile", action="store_true",
+                        help="write a cProfile dump per image to the processed folder's profiles directory")
+    return parser.parse_args(argv)
+
+
+def print_progress(folder_name):
+    def progress_callback(progress):
+        print(f"{folder_name}: {progress:.1f}%", flush=True)
+    return progress_callback
+
+
+def get_batch_name(folder_path, root_folder):
+    # Folders found by --recursive are named after their path below the root, so two cam0 folders do not collide
+    relative_path = os.path.relpath(folder_path, root_folder)
+    if relative_path == os.curdir:
+        return get_last_segment_of_path(root_folder)
+    return "_".join([get_last_segment_of_path(root_folder), *Path(relative_path).parts])
+
+
+def get_export_path(batch_name, output, extension):
+    return os.path.join(output, f"{batch_name}_analysis.{extension}")
+
+
+def open_csv_stream(batch_name, output, formats):
+    if 'csv' not in formats:
+        return None
+    return CsvStreamWriter(get_export_path(batch_name, output, "csv"), ANALYSIS_FIELDS)
+
+
+def export_results(results, folder_path, batch_name, output, formats):
+    if not results:
+        print(f"{folder_path}: no lines detected, nothing to export", file=sys.stderr)
+        return
+
+    for export_format in formats:
+        # CSV rows were already streamed while the folder was analysed
+        if export_format == 'csv':
+            continue
+        exporter, extension = EXPORTERS[export_format]
+        path_to_file = get_export_path(batch_name, output, extension)
+        exporter(iter_analysis_rows(results), path_to_file)
+        print(f"{folder_path}: wrote {path_to_file}", flush=True)
+
+
+def export_stage_timings(run_timings, folder_path, batch_name, output):
+    if not run_timings.per_image:
+        return
+
+    path_to_file = os.path.join(output, f"{batch_name}_stage_timings.csv")
+    run_timings.export_summary_csv(path_to_file)
+    print(f"{folder_path}: {run_timings.format_status()}, wrote {path_to_file}", flush=True)
+
+
+def run_folder(folder_path, arguments, result_cache, batch_name=None, image_files=None):
+    # image_files is the folder's listing when the caller already has it, as --recursive does
+    folder_name = get_last_segment_of_path(folder_path)
+    batch_name = batch_name or folder_name
+    run_timings = RunTimings()
+    processed_folder = os.path.join(folder_path, f"{folder_name}_processed")
+    profile_directory = None
+    if arguments.profile:
+        profile_directory = os.path.join(processed_folder, "profiles")
+
+    csv_stream = open_csv_stream(batch_name, arguments.output, arguments.formats)
+    result_store = None
+    annotation_store = None
+    if not arguments.no_store:
+        # The GUI reloads these results when the folder is opened
+        result_store = ResultStore(get_result_store_directory(processed_folder))
+        annotation_store = AnnotationStore(get_annotation_store_path(processed_folder))
+
+    def on_result(filename, result):
+        if result is None:
+            return
+        if csv_stream is not None:
+            csv_stream.write({**result, 'file': filename})
+        if result_store is not None:
+            result_store.append(filename, result)
+
+    try:
+        results, output_folder = auto_detection(
+            folder_path, print_progress(folder_name),
+            vectorized_kmeans=not arguments.legacy_kmeans,
+            detection_mode=arguments.detection_mode,
+            segmentation=arguments.segmentation,
+            diameter=arguments.diameter,
+            fit_max_iterations=arguments.fit_max_iterations or None,
+            warm_start_fit=arguments.fit_warm_start,
+            line_scoring=get_line_scoring(
+                arguments.line_vote_weight, arguments.line_angle_prior, arguments.line_angle_weight
+            ),
+            workers=arguments.workers,
+            chunk_size=arguments.chunk_size,
+            result_cache=result_cache,
+            write_overlays=not arguments.no_overlays,
+            jpeg_quality=arguments.jpeg_quality,
+            run_timings=run_timings,
+            profile_directory=profile_directory,
+            result_callback=on_result,
+            annotation_store=annotation_store,
+            image_files=image_files
+        )
+    finally:
+        if csv_stream is not None:
+            csv_stream.close()
+        if result_store is not None:
+            result_store.close()
+        if annotation_store is not None:
+            annotation_store.close()
+
+    if csv_stream is not None:
+        if csv_stream.row_count:
+            print(f"{folder_path}: wrote {csv_stream.path_to_file}", flush=True)
+        else:
+            os.remove(csv_stream.path_to_file)
+    print(f"{folder_path}: {len(results)} images analysed, overlays in {output_folder}", flush=True)
+    fit_failures = sum(math.isnan(result['blurriness']) for result in results.values())
+    if fit_failures:
+        print(f"{folder_path}: the edge fit failed on {fit_failures} images, their blurriness is NaN",
+              file=sys.stderr, flush=True)
+    export_results(results, folder_path, batch_name, arguments.output, arguments.formats)
+    export_stage_timings(run_timings, folder_path, batch_name, arguments.output)
+
+
+def replay_folder(folder_path, arguments, batch_name=None, image_files=None):
+    folder_name = get_last_segment_of_path(folder_path)
+    batch_name = batch_name or folder_name
+    processed_folder = os.path.join(folder_path, f"{folder_name}_processed")
+    annotation_path = get_annotation_store_path(processed_folder)
+    if not os.path.exists(annotation_path):
+        raise ValueError(f"No stored lines in {annotation_path}")
+    # One listing of the folder rather than a stat per stored line
+    if image_files is None:
+        image_files = list_image_files(folder_path)
+    annotations = AnnotationStore(annotation_path).get_annotations(set(image_files))
+
+    run_timings = RunTimings()
+    results = dict()
+    overlay_writer = None if arguments.no_overlays else OverlayWriter(jpeg_quality=arguments.jpeg_quality)
+
+    def record(filename, result, encoded_image, stage_durations):
+        results[filename] = result
+        run_timings.add(filename, stage_durations)
+        if encoded_image is not None:
+            overlay_writer.write(get_processed_image_path(processed_folder, filename), encoded_image)
+
+    try:
+        reanalyse_annotations(
+            folder_path, annotations, record,
+            diameter=arguments.diameter,
+            fit_max_iterations=arguments.fit_max_iterations or None,
+            workers=resolve_worker_count(arguments.workers),
+            chunk_size=arguments.chunk_size,
+            jpeg_quality=None if arguments.no_overlays else arguments.jpeg_quality,
+            progress_callback=print_progress(folder_name)
+        )
+    finally:
+        if overlay_writer is not None:
+            write_errors = overlay_writer.close()
+            if write_errors:
+                print(f"{folder_path}: failed to write {len(write_errors)} processed images", file=sys.stderr)
+
+    # Workers finish in any order, and lines are stored in the order the original run finished them; rows are
+    # written in file order, like a normal batch run
+    results = {filename: results[filename] for filename in image_files if filename in results}
+    if not arguments.no_store:
+        result_store = ResultStore(get_result_store_directory(processed_folder))
+        for filename, result in results.items():
+            result_store.append(filename, result)
+        result_store.close()
+    print(f"{folder_path}: {len(results)} images replayed from {annotation_path}", flush=True)
+    if 'csv' in arguments.formats and results:
+        path_to_file = get_export_path(batch_name, arguments.output, "csv")
+        export_to_csv(iter_analysis_rows(results), path_to_file)
+        print(f"{folder_path}: wrote {path_to_file}", flush=True)
+    export_results(results, folder_path, batch_name, arguments.output, arguments.formats)
+    export_stage_timings(run_timings, folder_path, batch_name, arguments.output)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    os.makedirs(arguments.output, exist_ok=True)
+    result_cache = None
+    if arguments.cache_dir:
+        result_cache = ResultCache(arguments.cache_dir, Settings.DEFAULT_VALUES["result_cache_max_entries"])
+
+    batch_count = 0
+    failed_folders = []
+
+    def run_batch(folder_path, batch_name=None, image_files=None):
+        nonlocal batch_count
+        batch_count += 1
+        try:
+            if arguments.replay:
+                replay_folder(folder_path, arguments, batch_name, image_files)
+            else:
+                run_folder(folder_path, arguments, result_cache, batch_name, image_files)
+        except ValueError as error:
+            # Problems with the folder or the options, e.g. a diameter larger than the images; no traceback needed
+            print(f"{folder_path}: failed: {error}", file=sys.stderr)
+            failed_folders.append(folder_path)
+        except Exception:
+            traceback.print_exc()
+            print(f"{folder_path}: failed", file=sys.stderr)
+            failed_folders.append(folder_path)
+
+    for folder_path in arguments.folders:
+        if not os.path.isdir(folder_path):
+            print(f"{folder_path}: not a directory", file=sys.stderr)
+            batch_count += 1
+            failed_folders.append(folder_path)
+            continue
+
+        if not arguments.recursive:
+            run_batch(folder_path)
+            continue
+        try:
+            # Each folder is analysed as soon as it is found, with the listing made while searching
+            for image_folder, image_files in iter_image_folders(folder_path):
+                run_batch(image_folder, get_batch_name(image_folder, folder_path), image_files)
+        except OSError as error:
+            print(f"{folder_path}: could not search for image folders: {error}", file=sys.stderr)
+            batch_count += 1
+            failed_folders.append(folder_path)
+
+    if result_cache is not None:
+        print(f"Cache: {result_cache.hits} hits, {result_cache.misses} misses", flush=True)
+        result_cache.close()
+
+    if failed_folders:
+        print(f"{len(failed_folders)} of {batch_count} folders failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,24 @@
 import os
-import PIL
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from .ImageAnalysis.AutoAnalysis import auto_detection, get_last_segment_of_path
-from .ImageAnalysis.SingleImageAnalysis import SingleImageAnalysis
+from .ImageAnalysis.AutoAnalysis import (
+    auto_detection, get_last_segment_of_path, get_line_scoring, get_processed_image_path, resolve_worker_count,
+    IMAGE_EXTENSIONS
+)
+from .ImageAnalysis.ManualAnalysis import analyse_annotation, reanalyse_annotations
+from .ImageAnalysis.RiseDistance import EdgeFitter
+from .ImageAnalysis.OverlayWriter import OverlayWriter
+from .ImageAnalysis.ImageHandle import ImageHandle
+from .ImageAnalysis.StageTimer import RunTimings, profiled
 from .Settings import Settings
+from .ResultCache import ResultCache
+from .FrameCache import FrameCache, get_frame_cache_directory
+from .ResultStore import ResultStore, StoredResults, get_result_store_directory
+from .AnnotationStore import AnnotationStore, get_annotation_store_path
+from .FolderWatcher import FolderWatcher
+from .FileIndex import FileIndex
+from .ProcessedIndex import ProcessedIndex
 from .Export import *
 from pathlib import Path
 
@@ -12,82 +27,504 @@ class DrawLineToolModel:
 
     def __init__(self):
         self.current_dir = None
+        self.file_index = None
+        # Index updates arrive on its scan thread; they must not interleave with loading another folder or with
+        # moving between images on the Tk thread. Reentrant, as an update looks up the current file while holding it
+        self.file_index_lock = threading.RLock()
         self.files = []
         self.current_file_index = None
         self.analysis = dict()
         self.settings = Settings()
         self.output_processed_folder = None
+        self.result_cache = None
+        self.frame_cache = None
+        self.result_store = None
+        self.annotation_store = None
+        self.folder_watcher = None
+        self.processed_index = ProcessedIndex()
+        self.overlay_writer = OverlayWriter(
+            max_queue_size=self.settings.get_option("overlay_write_queue_size"),
+            written_callback=self.processed_index.add
+        )
+        self.overlay_write_errors = []
+        # (filename, error) for watched captures that could not be analysed; filename is None if the folder was not
+        # readable
+        self.watch_errors = []
+        self.run_timings = RunTimings()
+        self.current_image_handle = None
+        # Drawn lines are analysed one at a time, in the order they were drawn, off the Tk thread
+        self.manual_executor = ThreadPoolExecutor(max_workers=1)
+        self.manual_lock = threading.Lock()
+        self.pending_analyses = dict()
+        self.line_annotations = dict()
 
     def load_directory(self, directory,progress_callback=None):
+        self.open_directory(directory)
+        if self.settings.get_option("run_auto_detection"):
+            self.run_auto_detection(progress_callback)
+
+    def open_directory(self, directory, index_callback=None):
+        # Returns once the first image is found; the rest of the folder is indexed on a background thread and
+        # index_callback() is called there as files are added and once they are sorted
+        self.stop_watching()
+        self.wait_for_manual_analyses()
+        self.stop_file_index()
         self.current_dir = directory
-        self.files = [file for file in os.listdir(directory) if file.endswith((".JPG", ".jpeg", ".jpg", ".png"))]
+        self.files = []
         self.current_file_index = 0
+        last_segment = get_last_segment_of_path(directory)
+        self.output_processed_folder = f"{directory}/{last_segment}_processed"
+        os.makedirs(self.output_processed_folder, exist_ok=True)
+        self.processed_index.load(self.output_processed_folder)
+        self.run_timings.clear()
+        self.open_result_store()
+        # Results of images that are no longer in the folder are dropped once the index is complete
+        self.analysis = self.load_stored_analysis()
+        self.line_annotations = dict()
+        self.watch_errors = []
+
+        self.file_index = FileIndex(
+            directory, update_callback=lambda file_index: self.on_file_index_update(file_index, index_callback)
+        )
+        self.file_index.start()
+        try:
+            self.file_index.wait_for_first_file()
+            if not self.files:
+                raise ValueError(f"No images found in {directory}")
+        except ValueError:
+            # Nothing is left open for a folder that cannot be shown
+            self.reset()
+            raise
+
+    def on_file_index_update(self, file_index, index_callback=None):
+        with self.file_index_lock:
+            if file_index is not self.file_index:
+                return
+            if file_index.is_complete():
+                # The sorted index replaces the scan order; the image being shown stays the current one
+                if self.files:
+                    self.current_file_index = file_index.files.index(self.get_current_file())
+                stale_files = [filename for filename in list(self.analysis) if filename not in file_index.names]
+                for filename in stale_files:
+                    self.analysis.pop(filename, None)
+            # Shared with the index, so files it adds later show up here as well
+            self.files = file_index.files
+        if index_callback:
+            index_callback()
+
+    def is_file_index_complete(self):
+        return self.file_index is None or self.file_index.is_complete()
+
+    def wait_for_file_index(self):
+        if self.file_index is not None:
+            self.file_index.wait()
+
+    def stop_file_index(self):
+        with self.file_index_lock:
+            if self.file_index is not None:
+                self.file_index.stop()
+                self.file_index = None
+
+    def run_auto_detection(self, progress_callback=None):
+        # Returns False if another folder was loaded during the run; its results are then dropped, as they belong to
+        # the folder the run started on
+        directory, file_index, analysis, result_store, annotation_store = (
+            self.current_dir, self.file_index, self.analysis, self.result_store, self.annotation_store
+        )
+        if file_index is None:
+            return False
+        options = {**self.get_auto_detection_options(), 'annotation_store': annotation_store}
+        # Detection runs over the whole folder in the sorted order, so it waits for the index to be complete
+        file_index.wait()
+        if options['result_cache'] is not None:
+            options['result_cache'].reset_stats()
+
+        def store_result(filename, result):
+            # Finding no line does not discard an earlier result for the image, e.g. a manual one
+            with self.file_index_lock:
+                if result is not None and file_index is self.file_index and result_store is not None:
+                    result_store.append(filename, result)
+
+        results, output_processed_folder = auto_detection(
+            directory, progress_callback, result_callback=store_result, image_files=file_index.get_files(), **options
+        )
+        with self.file_index_lock:
+            if file_index is not self.file_index:
+                return False
+            analysis.update(results)
+            self.output_processed_folder = output_processed_folder
+        self.flush_overlays()
+        if result_store is not None:
+            result_store.flush()
+        if annotation_store is not None:
+            annotation_store.flush()
+        return True
+
+    def get_auto_detection_options(self):
+        return {
+            'vectorized_kmeans': self.settings.get_option("use_vectorized_kmeans"),
+            'detection_mode': self.settings.get_option("detection_mode"),
+            'segmentation': self.settings.get_option("segmentation_backend"),
+            'diameter': self.settings.get_option("circle_diameter"),
+            'fit_max_iterations': self.get_fit_max_iterations(),
+            'warm_start_fit': self.settings.get_option("edge_fit_warm_start"),
+            'line_scoring': get_line_scoring(
+                self.settings.get_option("line_vote_weight"),
+                self.settings.get_option("line_angle_prior"),
+                self.settings.get_option("line_angle_weight")
+            ),
+            'workers': self.settings.get_option("auto_detection_workers"),
+            'chunk_size': self.settings.get_option("auto_detection_chunk_size"),
+            'result_cache': self.get_result_cache(),
+            'overlay_writer': self.get_overlay_writer(),
+            'write_overlays': self.settings.get_option("write_overlays"),
+            'jpeg_quality': self.settings.get_option("overlay_jpeg_quality"),
+            'run_timings': self.run_timings,
+            'profile_directory': self.get_profile_directory(),
+            'annotation_store': self.annotation_store
+        }
+
+    def get_fit_max_iterations(self):
+        # 0 in the settings means the fit runs until it converges
+        return self.settings.get_option("edge_fit_max_iterations") or None
+
+    def get_profile_directory(self):
+        if not self.settings.get_option("profile_analysis"):
+            return None
+        return os.path.join(self.output_processed_folder, "profiles")
+
+    def get_stage_timing_status(self):
+        return self.run_timings.format_status()
+
+    def open_result_store(self):
+        self.close_result_store()
+        if self.settings.get_option("persist_results"):
+            self.result_store = ResultStore(
+                get_result_store_directory(self.output_processed_folder),
+                flush_interval=self.settings.get_option("result_store_flush_seconds")
+            )
+            self.result_store.compact()
+            # Drawn and detected lines are kept with the results, so the metrics can be computed again later
+            self.annotation_store = AnnotationStore(
+                get_annotation_store_path(self.output_processed_folder),
+                flush_interval=self.settings.get_option("result_store_flush_seconds")
+            )
+            self.annotation_store.compact()
+
+    def close_result_store(self):
+        if self.result_store is not None:
+            self.result_store.close()
+            self.result_store = None
+        if self.annotation_store is not None:
+            self.annotation_store.close()
+            self.annotation_store = None
+
+    def load_stored_analysis(self):
+        if self.result_store is None:
+            return dict()
+        return self.result_store.read().to_analysis()
+
+    def store_result(self, filename, result, flush=False):
+        if self.result_store is not None:
+            self.result_store.append(filename, result)
+            if flush:
+                self.result_store.flush()
+
+    def get_overlay_writer(self):
+        self.overlay_writer.jpeg_quality = self.settings.get_option("overlay_jpeg_quality")
+        return self.overlay_writer
+
+    def flush_overlays(self):
+        self.overlay_write_errors.extend(self.overlay_writer.flush())
+        return self.overlay_write_errors
+
+    def start_watching(self, change_callback=None):
+        self.stop_watching()
+
+        def on_new_file(filename):
+            self.add_watched_file(filename)
+            if change_callback:
+                change_callback(filename)
+
+        def on_error(filename, error):
+            self.watch_errors.append((filename, error))
+            if change_callback:
+                change_callback(filename)
+
+        file_index = self.file_index
+
+        def get_loaded_files():
+            # Whatever is in the folder but was not indexed when it was loaded is treated as a new capture
+            if file_index is None or not file_index.is_scan_finished():
+                return None
+            return set(file_index.get_files())
+
+        self.folder_watcher = FolderWatcher(
+            self.current_dir, IMAGE_EXTENSIONS, on_new_file,
+            interval=self.settings.get_option("watch_interval_seconds"), error_callback=on_error,
+            loaded_files=get_loaded_files
+        )
+        self.folder_watcher.start()
+
+    def stop_watching(self):
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+
+    def add_watched_file(self, filename):
+        # The folder's state is taken once, so a capture that is still being analysed when another folder is loaded
+        # cannot end up in that folder's results
+        directory, file_index, analysis, result_store = (
+            self.current_dir, self.file_index, self.analysis, self.result_store
+        )
+        if file_index is None:
+            return
         if self.settings.get_option("run_auto_detection"):
-            self.analysis, self.output_processed_folder = auto_detection(directory, progress_callback)
-        else:
-            last_segment = get_last_segment_of_path(directory)
-            self.output_processed_folder = f"{directory}/{last_segment}_processed"
-            os.makedirs(self.output_processed_folder, exist_ok=True)
+            options = {**self.get_auto_detection_options(), 'workers': 1}
+            results, _ = auto_detection(directory, image_files=[filename], **options)
+            # A re-captured file replaces its earlier result, including a detection that no longer finds a line
+            analysis.pop(filename, None)
+            analysis.update(results)
+            if result_store is not None:
+                result_store.append(filename, results.get(filename))
+                result_store.flush()
+
+        with self.file_index_lock:
+            position = file_index.add(filename)
+            if file_index is self.file_index and position is not None and position <= self.current_file_index:
+                # The new capture sorts before the image being shown, which stays the current one
+                self.current_file_index += 1
+
+    def get_result_cache(self):
+        if not self.settings.get_option("use_result_cache"):
+            return None
+
+        directory = self.settings.get_option("result_cache_directory")
+        if self.result_cache is None or self.result_cache.directory != directory:
+            if self.result_cache is not None:
+                self.result_cache.close()
+            self.result_cache = ResultCache(directory, self.settings.get_option("result_cache_max_entries"))
+
+        return self.result_cache
+
+    def get_frame_cache(self):
+        if not self.settings.get_option("use_frame_cache") or self.output_processed_folder is None:
+            self.close_frame_cache()
+            return None
+
+        directory = get_frame_cache_directory(self.output_processed_folder)
+        max_bytes = self.settings.get_option("frame_cache_max_mb") * 1024 * 1024
+        if self.frame_cache is None or self.frame_cache.directory != directory:
+            self.close_frame_cache()
+            self.frame_cache = FrameCache(self.current_dir, directory, max_bytes)
+        self.frame_cache.max_bytes = max_bytes
+        return self.frame_cache
+
+    def close_frame_cache(self):
+        if self.frame_cache is not None:
+            self.frame_cache.close()
+            self.frame_cache = None
+
+    def get_result_cache_stats(self):
+        if self.result_cache is None or not self.settings.get_option("use_result_cache"):
+            return None
+        return self.result_cache.hits, self.result_cache.misses
 
     def get_current_file(self):
-        return self.files[self.current_file_index]
+        with self.file_index_lock:
+            return self.files[self.current_file_index]
 
     def cycle_next_file(self):
-        self.current_file_index += 1
-        if self.current_file_index >= len(self.files):
-            self.current_file_index = 0
-        return self.get_current_file()
+        with self.file_index_lock:
+            self.current_file_index += 1
+            if self.current_file_index >= len(self.files):
+                self.current_file_index = 0
+            return self.get_current_file()
 
     def cycle_previous_file(self):
-        self.current_file_index -= 1
-        if self.current_file_index < 0:
-            self.current_file_index = len(self.files) - 1
-        return self.get_current_file()
+        with self.file_index_lock:
+            self.current_file_index -= 1
+            if self.current_file_index < 0:
+                self.current_file_index = len(self.files) - 1
+            return self.get_current_file()
 
-    def get_current_image(self):
-        current_image_path = os.path.join(self.current_dir, self.get_current_file())
-        return PIL.Image.open(current_image_path).convert("L")
+    def get_processed_image(self, filename):
+        return self.processed_index.lookup(filename)
+
+    def get_image(self, filename):
+        # Kept after the analysis, so drawing another line on the same image does not decode the file again
+        image_path = os.path.join(self.current_dir, filename)
+        if self.current_image_handle is None or self.current_image_handle.path != image_path:
+            frame_cache = self.get_frame_cache()
+            if frame_cache is not None:
+                self.current_image_handle = frame_cache.get_image(filename)
+            else:
+                self.current_image_handle = ImageHandle(image_path)
+        return self.current_image_handle
+
+    def submit_analysis_for_current_image(self, line_points, is_object_lighter, done_callback=None):
+        # Returns at once; done_callback(filename, error) is called on the worker thread when the analysis finishes
+        if line_points is None:
+            raise ValueError("No line points provided")
+
+        filename = self.get_current_file()
+        future = self.manual_executor.submit(self.analyse_line, filename, list(line_points), is_object_lighter)
+        with self.manual_lock:
+            self.pending_analyses[filename] = future
+
+        def on_done(finished_future):
+            with self.manual_lock:
+                if self.pending_analyses.get(filename) is finished_future:
+                    del self.pending_analyses[filename]
+            if done_callback:
+                done_callback(filename, finished_future.exception())
+
+        future.add_done_callback(on_done)
+        return future
 
     def get_analysis_for_current_image(self, line_points, is_object_lighter):
-        if line_points is not None:
-            image = self.get_current_image()
-            contrast, angle, blurriness, line_overlay_image = SingleImageAnalysis(
-                image, line_points,
-                is_object_lighter
-            ).get_analysis()
+        self.submit_analysis_for_current_image(line_points, is_object_lighter).result()
 
-            self.analysis[self.get_current_file()] = {
-                'angle': angle,
-                'contrast': contrast,
-                'blurriness': blurriness
-            }
+    def is_analysis_pending(self, filename):
+        with self.manual_lock:
+            return filename in self.pending_analyses
 
-            image_save_path = os.path.join(self.output_processed_folder, f"{Path(self.get_current_file()).stem}_processed.jpg")
+    def wait_for_manual_analyses(self):
+        with self.manual_lock:
+            pending = list(self.pending_analyses.values())
+        wait(pending)
 
-            if os.path.exists(image_save_path):
-                os.remove(image_save_path)
-            line_overlay_image.save(image_save_path)
+    def analyse_line(self, filename, line_points, is_object_lighter):
+        profile_path = None
+        profile_directory = self.get_profile_directory()
+        if profile_directory is not None:
+            os.makedirs(profile_directory, exist_ok=True)
+            profile_path = os.path.join(profile_directory, f"{Path(filename).stem}_manual.prof")
 
-        else:
-            raise ValueError("No line points provided")
+        with profiled(profile_path):
+            result, line_overlay_image, stage_durations = analyse_annotation(
+                self.get_image(filename), line_points, is_object_lighter,
+                self.settings.get_option("circle_diameter"), EdgeFitter(self.get_fit_max_iterations())
+            )
+        self.run_timings.add(filename, stage_durations)
+        self.line_annotations[filename] = (line_points, is_object_lighter)
+        if self.annotation_store is not None:
+            self.annotation_store.append_drawn_line(filename, line_points, is_object_lighter)
+        self.analysis[filename] = result
+        self.store_result(filename, result, flush=True)
+
+        if self.settings.get_option("write_overlays"):
+            self.get_overlay_writer().write(
+                get_processed_image_path(self.output_processed_folder, filename), line_overlay_image
+            )
+
+    def get_annotations(self):
+        # Every stored line of the folder; without a store, the lines drawn since the folder was loaded
+        if self.annotation_store is not None:
+            self.wait_for_file_index()
+            return self.annotation_store.get_annotations(set(self.files))
+        return [
+            (filename, line, is_object_lighter)
+            for filename, (line, is_object_lighter) in self.line_annotations.items()
+        ]
+
+    def reanalyse_annotations(self, annotations=None, progress_callback=None):
+        # Applies stored lines again, in parallel; by default every annotation of the folder
+        self.wait_for_manual_analyses()
+        if annotations is None:
+            annotations = self.get_annotations()
+        annotations = list(annotations)
+        lines_by_file = {filename: (line_points, is_object_lighter)
+                         for filename, line_points, is_object_lighter in annotations}
+        write_overlays = self.settings.get_option("write_overlays")
+        results = dict()
+
+        def record(filename, result, encoded_image, stage_durations):
+            self.run_timings.add(filename, stage_durations)
+            self.line_annotations[filename] = lines_by_file[filename]
+            self.analysis[filename] = results[filename] = result
+            self.store_result(filename, result)
+            if encoded_image is not None:
+                self.get_overlay_writer().write(
+                    get_processed_image_path(self.output_processed_folder, filename), encoded_image
+                )
+
+        reanalyse_annotations(
+            self.current_dir, annotations, record,
+            diameter=self.settings.get_option("circle_diameter"),
+            fit_max_iterations=self.get_fit_max_iterations(),
+            workers=resolve_worker_count(self.settings.get_option("auto_detection_workers")),
+            chunk_size=self.settings.get_option("auto_detection_chunk_size"),
+            jpeg_quality=self.settings.get_option("overlay_jpeg_quality") if write_overlays else None,
+            progress_callback=progress_callback
+        )
+        self.flush_overlays()
+        if self.result_store is not None:
+            self.result_store.flush()
+        return results
 
     def reset(self):
+        self.stop_watching()
+        self.wait_for_manual_analyses()
+        self.stop_file_index()
         self.current_dir = None
         self.files = []
         self.current_file_index = None
         self.analysis = dict()
+        self.line_annotations = dict()
+        self.watch_errors = []
+        self.current_image_handle = None
+        self.close_frame_cache()
+        self.processed_index.clear()
+        self.run_timings = RunTimings()
+        self.close_result_store()
 
-    def export_analysis(self):
-        export_path = self.settings.get_option("analysis_export_path")
-        analysis_formatted = [
-            {**data, 'file': filename} for filename, data in self.analysis.items()
-        ]
-        if self.settings.get_option("export_to_csv"):
-            export_to_csv(analysis_formatted,os.path.join(export_path, "analysis.csv"))
-        if self.settings.get_option("export_to_excel"):
-            export_to_excel(analysis_formatted,os.path.join(export_path, "analysis.xlsx"))
-        if self.settings.get_option("export_to_mat"):
-            export_to_mat(analysis_formatted,os.path.join(export_path, "analysis.mat"))
+    def export_analysis(self, done_callback=None):
+        self.wait_for_manual_analyses()
+        self.wait_for_file_index()
+        write_errors = self.flush_overlays()
+        if write_errors:
+            self.overlay_write_errors = []
+            failed_paths = "\n".join(f"{path}: {error}" for path, error in write_errors)
+            raise ValueError(f"Failed to write {len(write_errors)} processed images:\n{failed_paths}")
+        if not self.analysis:
+            raise ValueError("There are no analysis results to export")
 
+        # reset() replaces rather than clears the timings, so the export keeps its own snapshot
+        if self.result_store is not None:
+            stored_results = self.result_store.read().select(self.analysis)
+        else:
+            stored_results = StoredResults.from_analysis(self.analysis)
+        run_timings = self.run_timings
+        export_path = self.settings.get_option("analysis_export_path")
+        formats = {
+            export_format: self.settings.get_option(f"export_to_{export_format}")
+            for export_format in ("csv", "excel", "mat")
+        }
         self.reset()
 
+        if done_callback is None:
+            write_analysis_files(stored_results, run_timings, export_path, formats)
+            return
+
+        def run_export():
+            try:
+                write_analysis_files(stored_results, run_timings, export_path, formats)
+            except Exception as error:
+                done_callback(error)
+            else:
+                done_callback(None)
+
+        threading.Thread(target=run_export).start()
+
+
+def write_analysis_files(stored_results, run_timings, export_path, formats):
+    if formats["csv"]:
+        export_to_csv(stored_results.iter_rows(), os.path.join(export_path, "analysis.csv"))
+    if formats["excel"]:
+        export_to_excel(stored_results.iter_rows(), os.path.join(export_path, "analysis.xlsx"))
+    if formats["mat"]:
+        export_columns_to_mat(stored_results.to_mat_columns(), os.path.join(export_path, "analysis.mat"))
+    if run_timings.per_image:
+        run_timings.export_summary_csv(os.path.join(export_path, "stage_timings.csv"))
+        run_timings.export_per_image_csv(os.path.join(export_path, "stage_timings_per_image.csv"))
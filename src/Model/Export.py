@@ -1,35 +1,105 @@
 from csv import DictWriter
+from itertools import chain
+from numbers import Real
+import numpy as np
 from openpyxl import Workbook
 from scipy.io import savemat
 
 """
- data should be in the format list of dictionary
+ data should be in the format list (or any iterable) of dictionary
  data = [
      {'name': 'Alice', 'age': 30, 'city': 'New York'},
      {'name': 'Bob', 'age': 25, 'city': 'Los Angeles'},
      {'name': 'Charlie', 'age': 35, 'city': 'Chicago'}
  ]
+ Rows are consumed one at a time, so a generator can be passed instead of building the whole list.
 """
 
+ANALYSIS_FIELDS = ['angle', 'contrast', 'blurriness', 'file']
+
+
+def iter_analysis_rows(analysis):
+    for filename, data in analysis.items():
+        yield {**data, 'file': filename}
+
+
+def peek_rows(data):
+    rows = iter(data)
+    first_row = next(rows, None)
+    if first_row is None:
+        raise ValueError("There are no analysis results to export")
+    return first_row, chain([first_row], rows)
+
 
 def export_to_csv(data, path_to_file):
+    first_row, rows = peek_rows(data)
     with open(path_to_file, 'w', newline='') as csvfile:
-        fieldnames = data[0].keys()
-        writer = DictWriter(csvfile, fieldnames=fieldnames)
+        writer = DictWriter(csvfile, fieldnames=first_row.keys())
         writer.writeheader()
-        for row in data:
+        for row in rows:
             writer.writerow(row)
 
 
+class CsvStreamWriter:
+    def __init__(self, path_to_file, fieldnames):
+        self.path_to_file = path_to_file
+        self.file = open(path_to_file, 'w', newline='')
+        self.writer = DictWriter(self.file, fieldnames=fieldnames)
+        self.writer.writeheader()
+        self.row_count = 0
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.row_count += 1
+
+    def close(self):
+        self.file.close()
+
+
 def export_to_excel(data, path_to_file):
-    wb = Workbook()
-    ws = wb.active
-    ws.append(list(data[0].keys()))
-    for row in data:
+    # A write-only workbook streams rows to disk instead of keeping every cell object in memory
+    first_row, rows = peek_rows(data)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(first_row.keys()))
+    for row in rows:
         ws.append(list(row.values()))
     wb.save(path_to_file)
 
 
-def export_to_mat(data, path_to_file):
-    mat_data = {key: [d[key] for d in data] for key in data[0].keys()}
+def is_numeric(value):
+    return isinstance(value, (Real, np.number)) and not isinstance(value, bool)
+
+
+def export_to_mat(data, path_to_file, row_count=None):
+    first_row, rows = peek_rows(data)
+    if row_count is None and hasattr(data, '__len__'):
+        row_count = len(data)
+    capacity = row_count or 1024
+
+    # Numeric columns are filled into preallocated float arrays, text columns are kept as lists
+    numeric_columns = {key: np.empty(capacity) for key, value in first_row.items() if is_numeric(value)}
+    text_columns = {key: [] for key in first_row.keys() if key not in numeric_columns}
+    count = 0
+    for row in rows:
+        if count == capacity:
+            capacity *= 2
+            numeric_columns = {key: np.resize(column, capacity) for key, column in numeric_columns.items()}
+        for key, column in numeric_columns.items():
+            column[count] = row[key]
+        for key, column in text_columns.items():
+            column.append(row[key])
+        count += 1
+
+    mat_data = {
+        key: numeric_columns[key][:count] if key in numeric_columns else text_columns[key]
+        for key in first_row.keys()
+    }
     savemat(path_to_file, mat_data)
+
+
+def export_columns_to_mat(columns, path_to_file):
+    # Columns that are already arrays, e.g. read from the result store, are written without a per-row pass
+    if not len(next(iter(columns.values()))):
+        raise ValueError("There are no analysis results to export")
+    savemat(path_to_file, columns)
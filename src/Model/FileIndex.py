@@ -0,0 +1,127 @@
+import os
+import threading
+
+from .ImageAnalysis.AutoAnalysis import iter_image_files, natural_sort_key, IMAGE_EXTENSIONS
+
+# Names found by the scan are handed over in pages of this many, so browsing can start before a large folder is read
+FILE_INDEX_PAGE_SIZE = 1024
+
+
+class FileIndex:
+    def __init__(self, directory, extensions=IMAGE_EXTENSIONS, page_size=FILE_INDEX_PAGE_SIZE, update_callback=None):
+        self.directory = directory
+        self.extensions = extensions
+        self.page_size = page_size
+        # Called on the scan thread with this index after every page and once more when the sorted index is ready
+        self.update_callback = update_callback
+        # In the order the directory returned them while scanning, in natural order once the scan is complete
+        self.files = []
+        self.names = set()
+        self.lock = threading.Lock()
+        self.complete = False
+        self.first_file_found = threading.Event()
+        # Set once the sorted index has also been handed to update_callback
+        self.scan_finished = threading.Event()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.scan_thread = threading.Thread(target=self.scan, daemon=True)
+
+    def start(self):
+        self.scan_thread.start()
+
+    def scan(self):
+        page = []
+        try:
+            for filename in iter_image_files(self.directory, self.extensions):
+                if self.stop_event.is_set():
+                    return
+                page.append(filename)
+                # The first image is published on its own, so it can be shown while the rest is read
+                if len(page) >= self.page_size or not self.first_file_found.is_set():
+                    self.publish(page)
+                    page = []
+            self.publish(page)
+            with self.lock:
+                self.files = sorted(self.files, key=natural_sort_key)
+                self.complete = True
+            if self.update_callback:
+                self.update_callback(self)
+        except OSError as error:
+            self.error = error
+        finally:
+            self.first_file_found.set()
+            self.scan_finished.set()
+
+    def publish(self, page):
+        if not page:
+            return
+        with self.lock:
+            # The list is only appended to while scanning, so a reader holding it sees a consistent prefix
+            for filename in page:
+                if filename not in self.names:
+                    self.names.add(filename)
+                    self.files.append(filename)
+        if self.update_callback:
+            self.update_callback(self)
+        self.first_file_found.set()
+
+    def stop(self):
+        # Ends the scan early, e.g. when another folder is loaded; the callback is not called again
+        self.stop_event.set()
+
+    def wait_for_first_file(self):
+        self.first_file_found.wait()
+        self.raise_error()
+
+    def wait(self):
+        self.scan_finished.wait()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise ValueError(f"Could not read {self.directory}: {self.error}")
+
+    def is_complete(self):
+        return self.complete
+
+    def is_scan_finished(self):
+        # Also true for a scan that failed or was stopped, which leaves the index incomplete
+        return self.scan_finished.is_set()
+
+    def get_files(self):
+        with self.lock:
+            return list(self.files)
+
+    def add(self, filename):
+        # Returns the position the file was inserted at, or None if it was already indexed
+        with self.lock:
+            if filename in self.names:
+                return None
+            self.names.add(filename)
+            position = len(self.files)
+            if self.complete:
+                # New captures usually sort last, so the search starts from the end
+                key = natural_sort_key(filename)
+                while position > 0 and natural_sort_key(self.files[position - 1]) > key:
+                    position -= 1
+            self.files.insert(position, filename)
+            return position
+
+
+def iter_image_folders(root_folder, extensions=IMAGE_EXTENSIONS):
+    # (folder, image files) for the root and every folder below it that holds images, depth first in natural order.
+    # The _processed output folders are skipped
+    image_files = []
+    subfolders = []
+    with os.scandir(root_folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.endswith("_processed"):
+                    subfolders.append(entry.name)
+            elif entry.name.endswith(extensions) and entry.is_file():
+                image_files.append(entry.name)
+
+    if image_files:
+        yield root_folder, sorted(image_files, key=natural_sort_key)
+    for subfolder in sorted(subfolders, key=natural_sort_key):
+        yield from iter_image_folders(os.path.join(root_folder, subfolder), extensions)
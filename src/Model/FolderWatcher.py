@@ -0,0 +1,102 @@
+import os
+import queue
+import threading
+
+
+class FolderWatcher:
+    def __init__(self, directory, extensions, file_callback, interval=2.0, error_callback=None, loaded_files=None):
+        self.directory = directory
+        self.extensions = extensions
+        self.file_callback = file_callback
+        self.interval = interval
+        # Called with (filename, error) when a file could not be handled, or (None, error) when the folder could not
+        # be read; watching carries on either way
+        self.error_callback = error_callback
+        # Returns the names that were loaded from the folder, or None while it is still being listed. Files found in
+        # the folder but not among them, e.g. captures written during the first analysis, are handed over as new.
+        # Without it, every file present when watching starts counts as loaded
+        self.loaded_files = loaded_files
+        self.file_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.poll_failing = False
+        self.poll_thread = threading.Thread(target=self.poll, daemon=True)
+        self.process_thread = threading.Thread(target=self.process, daemon=True)
+
+    def start(self):
+        self.poll_thread.start()
+        self.process_thread.start()
+
+    def stop(self):
+        # Waits for a file that is being handled, so no callback for this folder runs after stop() returns
+        self.stop_event.set()
+        self.file_queue.put(None)
+        for thread in (self.poll_thread, self.process_thread):
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join()
+
+    def report_error(self, filename, error):
+        if self.error_callback:
+            self.error_callback(filename, error)
+
+    def snapshot(self):
+        signatures = dict()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(self.extensions):
+                    stat = entry.stat()
+                    signatures[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def poll(self):
+        initial_state = self.get_initial_state()
+        while initial_state is None and not self.stop_event.wait(self.interval):
+            initial_state = self.get_initial_state()
+        if initial_state is None:
+            return
+        previous, handled = initial_state
+        while not self.stop_event.wait(self.interval):
+            current = self.try_snapshot()
+            if current is None:
+                continue
+            for filename, signature in current.items():
+                # Only hand over files whose size and mtime held still for a whole interval, so captures
+                # that are still being written are picked up on a later poll
+                if previous.get(filename) == signature and handled.get(filename) != signature:
+                    handled[filename] = signature
+                    self.file_queue.put(filename)
+            previous = current
+
+    def get_initial_state(self):
+        # (signatures of the folder, signatures of the files already loaded), or None until both are available
+        current = self.try_snapshot()
+        if current is None:
+            return None
+        if self.loaded_files is None:
+            return current, dict(current)
+        loaded_files = self.loaded_files()
+        if loaded_files is None:
+            return None
+        return current, {filename: signature for filename, signature in current.items() if filename in loaded_files}
+
+    def try_snapshot(self):
+        # A share that drops out for a moment, or a renamed folder, is reported once and polled again
+        try:
+            signatures = self.snapshot()
+        except OSError as error:
+            if not self.poll_failing:
+                self.poll_failing = True
+                self.report_error(None, error)
+            return None
+        self.poll_failing = False
+        return signatures
+
+    def process(self):
+        while not self.stop_event.is_set():
+            filename = self.file_queue.get()
+            if filename is None:
+                break
+            try:
+                self.file_callback(filename)
+            except Exception as error:
+                # An unreadable or half-written capture must not end the watch
+                self.report_error(filename, error)
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from .ImageAnalysis.ImageHandle import ImageHandle
+
+# Decoded grayscale frames, back to back as raw uint8 in one file; the index holds each frame's offset and shape
+FRAMES_FILE = "frames.bin"
+INDEX_FILE = "index.json"
+# Frames are only ever appended, as frames handed out earlier may still map any byte of the file. Evicted frames
+# leave dead bytes behind, and the live frames are rewritten to a new file once the file would grow past this many
+# times the budget, so a rewrite of up to the budget happens at most once per budget's worth of new frames
+MAX_FILE_GROWTH = 2
+
+
+def get_frame_cache_directory(output_processed_folder):
+    return os.path.join(output_processed_folder, "frame_cache")
+
+
+def get_source_signature(image_path):
+    stat = os.stat(image_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FrameCache:
+    def __init__(self, image_folder, directory, max_bytes):
+        self.image_folder = image_folder
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Manual analyses can run off the Tk thread
+        self.lock = threading.Lock()
+        self.frames = None
+        self.entries = dict()
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load_index(self):
+        try:
+            with open(self.get_path(INDEX_FILE), 'r') as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            entries = dict()
+        # Frames written after the last index update, or cut off by a crash, are not indexed and count as dead bytes
+        data_size = self.get_file_size()
+        self.entries = {
+            filename: entry for filename, entry in entries.items()
+            if entry['offset'] + entry['height'] * entry['width'] <= data_size
+        }
+
+    def write_index(self):
+        temporary_path = self.get_path(f"{INDEX_FILE}.tmp")
+        with open(temporary_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.get_path(INDEX_FILE))
+
+    def get_file_size(self):
+        frames_path = self.get_path(FRAMES_FILE)
+        return os.path.getsize(frames_path) if os.path.exists(frames_path) else 0
+
+    def get_used_bytes(self):
+        return max((entry['offset'] + entry['height'] * entry['width'] for entry in self.entries.values()), default=0)
+
+    def get_frames(self):
+        # Mapped again after the file has grown; frames already handed out keep their own mapping alive
+        used_bytes = self.get_used_bytes()
+        if self.frames is None or len(self.frames) < used_bytes:
+            self.frames = np.memmap(self.get_path(FRAMES_FILE), dtype=np.uint8, mode='r') if used_bytes else None
+        return self.frames
+
+    def get(self, filename):
+        image_path = os.path.join(self.image_folder, filename)
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is not None and [entry['mtime_ns'], entry['size']] != list(get_source_signature(image_path)):
+                # The image was replaced since it was cached
+                del self.entries[filename]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry['last_access'] = time.time()
+            start, height, width = entry['offset'], entry['height'], entry['width']
+            return self.get_frames()[start:start + height * width].reshape(height, width)
+
+    def put(self, filename, gray):
+        # Returns the frame as stored in the cache, or None if it could not be made to fit in the budget
+        image_path = os.path.join(self.image_folder, filename)
+        gray = np.ascontiguousarray(gray, dtype=np.uint8)
+        with self.lock:
+            self.entries.pop(filename, None)
+            if not self.make_room(gray.nbytes):
+                return None
+
+            offset = self.get_file_size()
+            with open(self.get_path(FRAMES_FILE), 'ab') as file:
+                file.write(gray.tobytes())
+            mtime_ns, size = get_source_signature(image_path)
+            self.entries[filename] = {
+                'offset': offset, 'height': gray.shape[0], 'width': gray.shape[1],
+                'mtime_ns': mtime_ns, 'size': size, 'last_access': time.time()
+            }
+            self.write_index()
+            return self.get_frames()[offset:offset + gray.nbytes].reshape(gray.shape)
+
+    def make_room(self, nbytes):
+        if nbytes > self.max_bytes:
+            return False
+
+        # Least recently used frames are dropped from the index until the new one fits in the budget
+        by_last_access = sorted(self.entries, key=lambda filename: self.entries[filename]['last_access'])
+        live_bytes = sum(entry['height'] * entry['width'] for entry in self.entries.values())
+        while live_bytes + nbytes > self.max_bytes:
+            entry = self.entries.pop(by_last_access.pop(0))
+            live_bytes -= entry['height'] * entry['width']
+        if self.get_file_size() + nbytes > self.max_bytes * MAX_FILE_GROWTH:
+            return self.compact()
+        return True
+
+    def compact(self):
+        # Written to a new file that replaces the old one, so frames still mapped elsewhere keep their pixels
+        frames = self.get_frames()
+        compacted_path = self.get_path(f"{FRAMES_FILE}.compact")
+        offset = 0
+        entries = dict()
+        with open(compacted_path, 'wb') as file:
+            for filename, entry in sorted(self.entries.items(), key=lambda item: item[1]['offset']):
+                nbytes = entry['height'] * entry['width']
+                file.write(frames[entry['offset']:entry['offset'] + nbytes].tobytes())
+                entries[filename] = {**entry, 'offset': offset}
+                offset += nbytes
+        frames = self.frames = None
+        try:
+            os.replace(compacted_path, self.get_path(FRAMES_FILE))
+        except OSError:
+            # Windows does not replace a file that is still mapped; the frame is then not cached this time
+            os.remove(compacted_path)
+            return False
+        self.entries = entries
+        self.write_index()
+        return True
+
+    def get_image(self, filename):
+        gray = self.get(filename)
+        if gray is None:
+            image_handle = ImageHandle(os.path.join(self.image_folder, filename))
+            gray = self.put(filename, image_handle.get_gray())
+            if gray is None:
+                return image_handle
+        # Mapped read-only, so the frame is used in place without a copy
+        return ImageHandle(os.path.join(self.image_folder, filename), gray)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        # Access times are only written with the index, so they are saved here for the next session
+        with self.lock:
+            self.write_index()
+            self.frames = None
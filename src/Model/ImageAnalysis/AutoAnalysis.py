@@ -1,33 +1,135 @@
 import cv2
 import numpy as np
-from PIL import Image
 from sklearn.cluster import KMeans
 import os
+import re
 from pathlib import Path
-import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 from .SingleImageAnalysis import calculate_image_property_from_cartesian_coordinate
+from .OverlayWriter import OverlayWriter
+from .StageTimer import StageTimer, NULL_TIMER, profiled
+from .RiseDistance import EdgeFitter
+from .CircleGeometry import DEFAULT_DIAMETER, get_circle_geometry, get_disk_mask, get_disk_pixels
+from .ImageHandle import ImageHandle
+
+# Bump whenever a change to the pipeline alters its output, so cached results are recomputed
+ANALYSIS_VERSION = 3
+BLUR_KERNEL_SIZE = (5, 5)
+BLUR_SIGMA = 5
+CANNY_THRESHOLDS = (50, 100)
+HOUGH_THRESHOLD = 50
+IMAGE_EXTENSIONS = (".JPG", ".jpeg", ".jpg", ".png")
+NATURAL_SORT_PATTERN = re.compile(r"(\d+)")
+DETECTION_MODES = ("standard", "multiscale")
+SEGMENTATION_BACKENDS = ("kmeans", "otsu", "two_means")
+# Multiscale mode finds the line on an image downsampled this many times by 2, then refines it at full resolution
+MULTISCALE_PYRAMID_LEVELS = 1
+MULTISCALE_REFINE_BAND = 4
+MULTISCALE_MIN_EDGE_POINTS = 10
+# Line candidates kept per image, so alternatives to the selected line are available without another Hough pass
+LINE_CANDIDATE_COUNT = 5
 
 
 def get_last_segment_of_path(path):
     return Path(path).name
 
 
-def open_and_convert_to_grayscale(image_path):
-    original_image = Image.open(image_path).convert('L')
-    return np.array(original_image)
+def encode_number(match):
+    # A run of digits becomes its length as a character below any printable one, then the digits, so a shorter
+    # number sorts first and numbers of the same length compare digit by digit
+    digits = match.group().lstrip("0")
+    return f"{chr(len(digits) + 1)}{digits}"
 
 
-def apply_gaussian_blur(image, kernel_size=(5, 5), sigmaX=5, sigmaY=5):
+def natural_sort_key(filename):
+    # "img_2.jpg" sorts before "img_10.jpg": runs of digits compare by value, the rest ignoring case, and the name
+    # itself breaks ties. Encoding the numbers into one string sorts a large folder about twice as fast as splitting
+    # the name into text and number parts
+    return NATURAL_SORT_PATTERN.sub(encode_number, filename.lower()), filename
+
+
+def iter_image_files(folder_path, extensions=IMAGE_EXTENSIONS):
+    # Names are yielded as the directory is read, so the first ones are available before a large folder is listed
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.name.endswith(extensions) and entry.is_file():
+                yield entry.name
+
+
+def list_image_files(folder_path):
+    return sorted(iter_image_files(folder_path), key=natural_sort_key)
+
+
+def apply_gaussian_blur(image, kernel_size=BLUR_KERNEL_SIZE, sigmaX=BLUR_SIGMA, sigmaY=BLUR_SIGMA):
     return cv2.GaussianBlur(image, kernel_size, sigmaX, sigmaY)
 
 
-def crop_to_circle(image, diameter):
-    midX, midY = image.shape[1] // 2, image.shape[0] // 2
-    radius = diameter // 2
-    return image[midY - radius:midY + radius, midX - radius:midX + radius]
+def segment_image(image, backend="kmeans", vectorized_kmeans=True, radius=DEFAULT_DIAMETER // 2):
+    if backend == "kmeans":
+        return kmeans_clustering(image, vectorized=vectorized_kmeans, radius=radius)
+
+    # Histogram backends split on intensity alone, in one pass over the pixels plus a pass over 256 bins
+    mask = get_disk_mask(image.shape, radius)
+    histogram = np.bincount(image[mask], minlength=256)
+    threshold = otsu_threshold(histogram) if backend == "otsu" else two_means_threshold(histogram)
+    return np.where(mask & (image > threshold), 255, 0).astype(np.uint8)
+
+
+def otsu_threshold(histogram):
+    levels = np.arange(len(histogram))
+    weight_below = np.cumsum(histogram)
+    weight_above = weight_below[-1] - weight_below
+    sum_below = np.cumsum(histogram * levels)
+    mean_below = sum_below / np.maximum(weight_below, 1)
+    mean_above = (sum_below[-1] - sum_below) / np.maximum(weight_above, 1)
+    between_class_variance = weight_below * weight_above * (mean_below - mean_above) ** 2
+    return int(np.argmax(between_class_variance))
+
+
+def two_means_threshold(histogram, max_iterations=100):
+    # 1-D k-means with two clusters: the threshold settles midway between the means of the two sides
+    levels = np.arange(len(histogram))
+    weight_below = np.cumsum(histogram)
+    sum_below = np.cumsum(histogram * levels)
+    total_weight, total_sum = weight_below[-1], sum_below[-1]
+    threshold = int(total_sum / max(total_weight, 1))
+    for _ in range(max_iterations):
+        weight_above = total_weight - weight_below[threshold]
+        if weight_below[threshold] == 0 or weight_above == 0:
+            break
+        mean_below = sum_below[threshold] / weight_below[threshold]
+        mean_above = (total_sum - sum_below[threshold]) / weight_above
+        next_threshold = int((mean_below + mean_above) / 2)
+        if next_threshold == threshold:
+            break
+        threshold = next_threshold
+    return threshold
+
+
+def kmeans_clustering(image, vectorized=True, radius=DEFAULT_DIAMETER // 2):
+    if not vectorized:
+        # The original implementation, kept unchanged for comparison, only knows the default circle
+        if radius != DEFAULT_DIAMETER // 2:
+            raise ValueError(f"The legacy k-means only runs on the original {DEFAULT_DIAMETER} pixel circle; "
+                             f"turn it off for other circle diameters or the multiscale detection mode")
+        return kmeans_clustering_legacy(image)
+
+    # The samples come in the legacy comprehension's row-major order, but the disk leaves out its boundary
+    # (< radius ** 2 where the legacy code has <=), like every other use of the circle; at the default radius that
+    # drops the two boundary pixels at (0, 118) and (118, 0)
+    rows, cols, _ = get_disk_pixels(image.shape, radius)
+    data = np.column_stack((rows, cols, image[rows, cols])).astype(np.float64)
+
+    labels = KMeans(n_clusters=2).fit(data).labels_
 
+    clustered_image = np.zeros(image.shape, dtype=np.uint8)
+    clustered_image[rows, cols] = np.where(labels == 1, 255, 0)
+
+    return clustered_image
 
-def kmeans_clustering(image):
+
+def kmeans_clustering_legacy(image):
     data = [(row, col, image[row, col])
             for row in range(image.shape[0])
             for col in range(image.shape[1])
@@ -44,37 +146,157 @@ def kmeans_clustering(image):
 
 
 def edge_detection(image):
-    return cv2.Canny(image, 50, 100, apertureSize=3)
-
-
-def find_closest_line_to_center(lines, center):
-    min_distance = float('inf')
-    closest_line = None
-
-    for line in lines:
-        rho, theta = line[0]
-        distance = abs(rho - center[0] * np.cos(theta) - center[1] * np.sin(theta))
-        if distance < min_distance:
-            min_distance = distance
-            closest_line = line
-
-    return closest_line
-
-
-def calculate_image_property(image, line, mid_x, mid_y, diameter):
+    return cv2.Canny(image, *CANNY_THRESHOLDS, apertureSize=3)
+
+
+def hough_lines(edges, threshold):
+    # Rows of (rho, theta, votes); HoughLines finds the same lines but drops the votes
+    lines = cv2.HoughLinesWithAccumulator(edges, 1, np.pi / 180, threshold=threshold)
+    return np.empty((0, 3), dtype=np.float32) if lines is None else lines.reshape(-1, 3)
+
+
+def score_lines(lines, center, vote_weight=0.0, angle_prior=None, angle_weight=0.0):
+    # Higher is better: minus the distance from the centre in pixels, plus vote_weight pixels for the line with the
+    # most votes, minus angle_weight pixels per degree the line is away from the expected edge angle
+    rho, theta = lines[:, 0], lines[:, 1]
+    scores = -np.abs(rho - center[0] * np.cos(theta) - center[1] * np.sin(theta))
+    if vote_weight and len(lines):
+        scores = scores + vote_weight * lines[:, 2] / np.max(lines[:, 2])
+    if angle_prior is not None and angle_weight:
+        # theta is the angle of the line's normal, and theta and theta + pi describe the same line
+        expected_theta = np.deg2rad((90 - angle_prior) % 180)
+        difference = np.abs((theta - expected_theta + np.pi / 2) % np.pi - np.pi / 2)
+        scores = scores - angle_weight * np.rad2deg(difference)
+    return scores
+
+
+def rank_lines(lines, center, top_k=LINE_CANDIDATE_COUNT, line_scoring=None):
+    scores = score_lines(lines, center, **(line_scoring or {}))
+    # Stable, so equally scored lines keep the order HoughLines returned them in, most votes first
+    order = np.argsort(-scores, kind='stable')[:top_k]
+    return lines[order], scores[order]
+
+
+def get_line_scoring(vote_weight=0.0, angle_prior=None, angle_weight=0.0):
+    # None when every weight is off, so the cache key and the selection match plain closest-to-centre
+    if not vote_weight and (angle_prior is None or not angle_weight):
+        return None
+    return {'vote_weight': vote_weight, 'angle_prior': angle_prior, 'angle_weight': angle_weight}
+
+
+def detect_line(cropped_image, segmentation="kmeans", vectorized_kmeans=True, timer=NULL_TIMER, line_scoring=None):
+    # Returns the best candidates as rows of (rho, theta, votes) in crop coordinates, best first, with their scores
+    radius = cropped_image.shape[0] // 2
+    with timer.stage("segmentation"):
+        clustered_image = segment_image(cropped_image, segmentation, vectorized_kmeans, radius)
+    with timer.stage("canny"):
+        edges = edge_detection(clustered_image)
+
+    with timer.stage("hough"):
+        lines = hough_lines(edges, HOUGH_THRESHOLD)
+    with timer.stage("line_selection"):
+        candidates, scores = rank_lines(lines, (radius, radius), line_scoring=line_scoring)
+    return clustered_image, candidates, scores
+
+
+def detect_line_multiscale(cropped_image, segmentation="kmeans", vectorized_kmeans=True, timer=NULL_TIMER,
+                           line_scoring=None):
+    scale = 2 ** MULTISCALE_PYRAMID_LEVELS
+    with timer.stage("pyramid"):
+        coarse_image = cropped_image
+        for _ in range(MULTISCALE_PYRAMID_LEVELS):
+            coarse_image = cv2.pyrDown(coarse_image)
+    coarse_radius = coarse_image.shape[0] // 2
+
+    with timer.stage("segmentation"):
+        coarse_clustered = segment_image(coarse_image, segmentation, vectorized_kmeans, coarse_radius)
+    with timer.stage("canny"):
+        coarse_edges = edge_detection(coarse_clustered)
+    with timer.stage("hough"):
+        lines = hough_lines(coarse_edges, HOUGH_THRESHOLD // scale)
+    with timer.stage("line_selection"):
+        coarse_candidates, _ = rank_lines(lines, (coarse_radius, coarse_radius), line_scoring=line_scoring)
+    if not len(coarse_candidates):
+        return np.zeros(cropped_image.shape, dtype=np.uint8), coarse_candidates, np.empty(0)
+
+    with timer.stage("refinement"):
+        clustered_image, refined_line = refine_line(
+            cropped_image, coarse_image, coarse_clustered, coarse_candidates[:1, :2], scale
+        )
+    if refined_line is None:
+        return clustered_image, np.empty((0, 3), dtype=np.float32), np.empty(0)
+
+    # Only the best line is refined; the alternatives are the coarse lines mapped to full resolution
+    candidates = coarse_candidates.copy()
+    candidates[:, 0] = (candidates[:, 0] * scale
+                        + (scale - 1) / 2 * (np.cos(candidates[:, 1]) + np.sin(candidates[:, 1])))
+    candidates[0, :2] = refined_line[0]
+    radius = cropped_image.shape[0] // 2
+    return clustered_image, candidates, score_lines(candidates, (radius, radius), **(line_scoring or {}))
+
+
+def get_line_candidates(candidates, scores):
+    # (rho, theta, votes, score) per candidate, best first, as plain floats that can be stored or sent between processes
+    return [(float(rho), float(theta), float(votes), float(score))
+            for (rho, theta, votes), score in zip(candidates.tolist(), scores.tolist())]
+
+
+def refine_line(cropped_image, coarse_image, coarse_clustered, coarse_line, scale):
+    # The full-resolution crop is split midway between the two coarse clusters instead of running k-means again
+    coarse_circle = get_disk_mask(coarse_image.shape, coarse_image.shape[0] // 2)
+    cluster = coarse_clustered > 0
+    if not (coarse_circle & cluster).any() or not (coarse_circle & ~cluster).any():
+        return np.zeros(cropped_image.shape, dtype=np.uint8), None
+    threshold = (coarse_image[coarse_circle & cluster].mean() + coarse_image[coarse_circle & ~cluster].mean()) / 2
+
+    radius = cropped_image.shape[0] // 2
+    circle = get_disk_mask(cropped_image.shape, radius)
+    brighter_cluster = coarse_image[coarse_circle & cluster].mean() > threshold
+    clustered_image = np.where(circle & ((cropped_image > threshold) == brighter_cluster), 255, 0).astype(np.uint8)
+    edge_rows, edge_cols = np.nonzero(edge_detection(clustered_image))
+
+    # Coarse pixel i covers full-resolution pixels scale * i .. scale * i + scale - 1
+    coarse_rho, theta = coarse_line[0]
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    rho = coarse_rho * scale + (scale - 1) / 2 * (cos_theta + sin_theta)
+
+    # Only edge pixels in a narrow band around the coarse line are fitted; the circle's own outline is left out
+    near_line = np.abs(edge_cols * cos_theta + edge_rows * sin_theta - rho) <= MULTISCALE_REFINE_BAND
+    inside = (edge_rows - radius) ** 2 + (edge_cols - radius) ** 2 < (radius - 3) ** 2
+    points = np.column_stack((edge_cols, edge_rows))[near_line & inside].astype(np.float32)
+    if len(points) < MULTISCALE_MIN_EDGE_POINTS:
+        return clustered_image, np.array([[rho, theta]], dtype=np.float32)
+
+    direction_x, direction_y, point_x, point_y = cv2.fitLine(points, cv2.DIST_HUBER, 0, 0.01, 0.01).ravel()
+    # The line's normal gives theta; it is folded into [0, pi) like the angles HoughLines returns
+    refined_theta = np.arctan2(direction_x, -direction_y)
+    if refined_theta < 0:
+        refined_theta += np.pi
+    elif refined_theta >= np.pi:
+        refined_theta -= np.pi
+    refined_rho = point_x * np.cos(refined_theta) + point_y * np.sin(refined_theta)
+    return clustered_image, np.array([[refined_rho, refined_theta]], dtype=np.float32)
+
+
+def polar_line_to_points(line, mid_x, mid_y, diameter):
+    # (rho, theta) are relative to the cropped circle; the returned points are in full image coordinates
     rho, theta = line[0]
     a, b = np.cos(theta), np.sin(theta)
     radius = diameter // 2
     x0 = a * rho + mid_x - radius
     y0 = b * rho + mid_y - radius
     x1 = int(x0 + 10000 * (-b))
-    y1 = int(y0 + 10000 * (a))
+    y1 = int(y0 + 10000 * a)
     x2 = int(x0 - 10000 * (-b))
-    y2 = int(y0 - 10000 * (a))
-    point1, point2 = (x1, y1), (x2, y2)
+    y2 = int(y0 - 10000 * a)
+    return (x1, y1), (x2, y2)
+
+
+def calculate_image_property(image, line, mid_x, mid_y, diameter, timer=NULL_TIMER, edge_fitter=None):
+    point1, point2 = polar_line_to_points(line, mid_x, mid_y, diameter)
     adjusted_angle, contrast, blurriness = calculate_image_property_from_cartesian_coordinate(
-        image=image, line_points=(point1, point2),
-        mid_x=mid_x, mid_y=mid_y, diameter=diameter, is_object_lighter=False
+        image=image, line_points=(point1, point2), diameter=diameter, is_object_lighter=False, timer=timer,
+        edge_fitter=edge_fitter
     )
     return adjusted_angle, contrast, blurriness
 
@@ -85,89 +307,298 @@ def draw_line_and_text_from_auto_detection(
         color=(0, 0, 255)
 ):
     if line is not None:
-        rho, theta = line[0]
-        a, b = np.cos(theta), np.sin(theta)
-        radius = diameter // 2
-        x0 = a * rho + mid_x - radius
-        y0 = b * rho + mid_y - radius
-        x1 = int(x0 + 10000 * (-b))
-        y1 = int(y0 + 10000 * a)
-        x2 = int(x0 - 10000 * (-b))
-        y2 = int(y0 - 10000 * a)
-        cv2.line(image, (x1, y1), (x2, y2), color, 2)
+        point1, point2 = polar_line_to_points(line, mid_x, mid_y, diameter)
+        cv2.line(image, point1, point2, color, 2)
 
     info_text = f'Angle: {angle:.3f} deg, Contrast: {contrast:.3f}, Blurriness: {blurriness:.5f}'
     cv2.putText(image, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (147, 155, 26), 2)
 
 
-def process_image(image_path, diameter=236):
-    original_image = open_and_convert_to_grayscale(image_path)
-    original_color_image = cv2.cvtColor(original_image, cv2.COLOR_GRAY2BGR)
-    blurred_image = apply_gaussian_blur(original_image)
-    cropped_image = crop_to_circle(blurred_image, diameter)
-    clustered_image = kmeans_clustering(cropped_image)
-    edges = edge_detection(clustered_image)
+def get_analysis_parameters(diameter=DEFAULT_DIAMETER, **options):
+    return {
+        'version': ANALYSIS_VERSION,
+        'diameter': diameter,
+        'blur_kernel_size': list(BLUR_KERNEL_SIZE),
+        'blur_sigma': BLUR_SIGMA,
+        'canny_thresholds': list(CANNY_THRESHOLDS),
+        'hough_threshold': HOUGH_THRESHOLD,
+        **options
+    }
 
-    lines = cv2.HoughLines(edges, 1, np.pi / 180, threshold=50)
-    radius = diameter // 2
-    mid_x, mid_y = original_image.shape[1] // 2, original_image.shape[0] // 2
-    closest_line = find_closest_line_to_center(lines, (mid_x, mid_y)) if lines is not None else None
+
+def draw_processed_overlay(image_handle, line, angle, contrast, blurriness, diameter):
+    original_color_image = image_handle.create_overlay_image()
+    mid_x, mid_y = image_handle.get_size()[0] // 2, image_handle.get_size()[1] // 2
+    if line is not None:
+        draw_line_and_text_from_auto_detection(
+            original_color_image, line, angle,
+            contrast, blurriness, mid_x, mid_y, diameter
+        )
+
+    cv2.circle(original_color_image, (mid_x, mid_y), diameter // 2, (0, 255, 0), 2)
+    return original_color_image
+
+
+def redraw_processed_image(image_path, result, detected_line, diameter=DEFAULT_DIAMETER):
+    line, angle, contrast, blurriness = None, None, None, None
+    if detected_line is not None and result is not None:
+        line = [detected_line]
+        angle, contrast, blurriness = result['angle'], result['contrast'], result['blurriness']
+
+    return draw_processed_overlay(ImageHandle(image_path), line, angle, contrast, blurriness, diameter)
+
+
+def process_image(image, diameter=DEFAULT_DIAMETER, vectorized_kmeans=True, detection_mode="standard",
+                  segmentation="kmeans", line_scoring=None, timer=NULL_TIMER, edge_fitter=None, draw_overlay=True):
+    # image is a path or an ImageHandle; without draw_overlay no colour image is allocated and None is returned for it.
+    # The ranked line candidates are returned as well, so an alternative line can be chosen without another Hough pass
+    if detection_mode not in DETECTION_MODES:
+        raise ValueError(f"Unknown detection mode {detection_mode!r}, expected one of {', '.join(DETECTION_MODES)}")
+    if segmentation not in SEGMENTATION_BACKENDS:
+        raise ValueError(
+            f"Unknown segmentation backend {segmentation!r}, expected one of {', '.join(SEGMENTATION_BACKENDS)}"
+        )
+
+    image_handle = image if isinstance(image, ImageHandle) else ImageHandle(image)
+    with timer.stage("decode"):
+        original_image = image_handle.get_gray()
+    with timer.stage("gaussian_blur"):
+        blurred_image = apply_gaussian_blur(original_image)
+    geometry = get_circle_geometry(original_image.shape, diameter)
+    with timer.stage("crop"):
+        cropped_image = blurred_image[geometry.window]
+
+    radius, mid_x, mid_y = geometry.radius, geometry.mid_x, geometry.mid_y
+    if detection_mode == "multiscale":
+        clustered_image, candidates, scores = detect_line_multiscale(
+            cropped_image, segmentation, vectorized_kmeans, timer, line_scoring
+        )
+    else:
+        clustered_image, candidates, scores = detect_line(
+            cropped_image, segmentation, vectorized_kmeans, timer, line_scoring
+        )
+    closest_line = candidates[:1, :2] if len(candidates) else None
+    line_candidates = get_line_candidates(candidates, scores)
 
     line_angle, contrast, blurriness = (None, None, None)
     if closest_line is not None:
         line_angle, contrast, blurriness = calculate_image_property(
             original_image, closest_line, mid_x, mid_y,
-            diameter
+            diameter, timer, edge_fitter
         )
 
-        draw_line_and_text_from_auto_detection(
-            original_color_image, closest_line, line_angle,
-            contrast, blurriness, mid_x, mid_y, diameter
+    original_color_image = None
+    if draw_overlay:
+        with timer.stage("overlay"):
+            if closest_line is not None:
+                draw_line_and_text_from_auto_detection(
+                    clustered_image, closest_line, line_angle, contrast, blurriness,
+                    radius, radius, diameter, color=(155, 155, 155)
+                )
+
+            original_color_image = draw_processed_overlay(
+                image_handle, closest_line, line_angle, contrast, blurriness, diameter
+            )
+
+    return original_color_image, clustered_image, line_angle, contrast, blurriness, closest_line, line_candidates
+
+
+def analyse_file(folder_path, filename, vectorized_kmeans=True, detection_mode="standard", segmentation="kmeans",
+                 diameter=DEFAULT_DIAMETER, fit_max_iterations=None, line_scoring=None, profile_directory=None,
+                 edge_fitter=None, draw_overlay=True):
+    image_path = os.path.join(folder_path, filename)
+    if edge_fitter is None:
+        edge_fitter = EdgeFitter(fit_max_iterations)
+    timer = StageTimer()
+    profile_path = None
+    if profile_directory is not None:
+        profile_path = os.path.join(profile_directory, f"{Path(filename).stem}.prof")
+
+    with profiled(profile_path), timer.stage("total"):
+        processed_image, clustered_image, angle, contrast, blurriness, line, line_candidates = process_image(
+            image_path, diameter, vectorized_kmeans=vectorized_kmeans, detection_mode=detection_mode,
+            segmentation=segmentation, line_scoring=line_scoring, timer=timer, edge_fitter=edge_fitter,
+            draw_overlay=draw_overlay
         )
 
-        draw_line_and_text_from_auto_detection(
-            clustered_image, closest_line, line_angle, contrast, blurriness,
-            radius, radius, diameter, color=(155, 155, 155)
+    result = None
+    if angle is not None and contrast is not None:
+        result = {
+            'angle': angle,
+            'contrast': contrast,
+            'blurriness': blurriness
+        }
+
+    detected_line = None
+    if line is not None:
+        detected_line = (float(line[0][0]), float(line[0][1]))
+
+    return result, detected_line, processed_image, timer.durations, line_candidates
+
+
+def analyse_file_chunk(folder_path, filenames, options, jpeg_quality=None, profile_directory=None,
+                       warm_start_fit=False):
+    # Runs in a worker process; overlays are JPEG-encoded here so only compact bytes cross the process boundary
+    analysed = []
+    # The files of a chunk are neighbours in the folder; with warm_start_fit each edge fit starts from the previous one
+    edge_fitter = EdgeFitter(options['fit_max_iterations'], warm_start_fit)
+    for filename in filenames:
+        result, detected_line, processed_image, stage_durations, line_candidates = analyse_file(
+            folder_path, filename, profile_directory=profile_directory, edge_fitter=edge_fitter,
+            draw_overlay=jpeg_quality is not None, **options
         )
+        encoded_image = None
+        if processed_image is not None:
+            _, encoded_image = cv2.imencode(".jpg", processed_image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            encoded_image = encoded_image.tobytes()
+        analysed.append((filename, result, detected_line, encoded_image, stage_durations, line_candidates))
+    return analysed
 
-    cv2.circle(original_color_image, (mid_x, mid_y), radius, (0, 255, 0), 2)
 
-    return original_color_image, clustered_image, line_angle, contrast, blurriness
+def get_processed_image_path(output_folder, filename):
+    return os.path.join(output_folder, f"{Path(filename).stem}_processed.jpg")
 
 
-def auto_detection(folder_path, progress_callback=None):
-    start_time = time.time()
+def resolve_worker_count(workers):
+    if not workers or workers < 0:
+        return os.cpu_count() or 1
+    return workers
 
+
+def auto_detection(folder_path, progress_callback=None, vectorized_kmeans=True, detection_mode="standard",
+                   segmentation="kmeans", diameter=DEFAULT_DIAMETER, fit_max_iterations=None, warm_start_fit=False,
+                   line_scoring=None, workers=1, chunk_size=4, result_cache=None, image_files=None, overlay_writer=None,
+                   write_overlays=True, jpeg_quality=95, run_timings=None, profile_directory=None,
+                   result_callback=None, annotation_store=None):
     last_segment = get_last_segment_of_path(folder_path)
     output_folder = f"{folder_path}/{last_segment}_processed"
     os.makedirs(output_folder, exist_ok=True)
 
     results = dict()
-    image_files = [file for file in os.listdir(folder_path) if file.endswith((".JPG", ".jpeg", ".jpg", ".png"))]
+    if image_files is None:
+        image_files = list_image_files(folder_path)
     total_files = len(image_files)
-    for index, filename in enumerate(image_files):
-        image_path = os.path.join(folder_path, filename)
-        processed_image, clustered_image, angle, contrast, blurriness = process_image(image_path)
-
+    options = {
+        'vectorized_kmeans': vectorized_kmeans, 'detection_mode': detection_mode, 'segmentation': segmentation,
+        'diameter': diameter, 'fit_max_iterations': fit_max_iterations, 'line_scoring': line_scoring
+    }
+    completed_files = 0
+    cache_keys = dict()
+
+    # Without a writer from the caller, overlays still go through a background writer that is drained before returning
+    owns_overlay_writer = overlay_writer is None and write_overlays
+    if owns_overlay_writer:
+        overlay_writer = OverlayWriter(jpeg_quality=jpeg_quality)
+
+    if profile_directory is not None:
+        os.makedirs(profile_directory, exist_ok=True)
+
+    # Results are handed to result_callback in image_files order, holding back any that finish early
+    finished_files = set()
+    next_file_index = 0
+
+    def emit_finished_in_order():
+        nonlocal next_file_index
+        while next_file_index < total_files and image_files[next_file_index] in finished_files:
+            filename = image_files[next_file_index]
+            finished_files.discard(filename)
+            result_callback(filename, results.get(filename))
+            next_file_index += 1
+
+    def record(filename, result, detected_line, processed_image, stage_durations=None, line_candidates=None):
+        nonlocal completed_files
+        if result is not None:
+            results[filename] = result
+        if run_timings is not None:
+            run_timings.add(filename, stage_durations)
+        if processed_image is not None and write_overlays:
+            overlay_writer.write(get_processed_image_path(output_folder, filename), processed_image)
+        # A warm-started fit depends on the image fitted before it, so its result is not cached for other runs
+        if filename in cache_keys and not warm_start_fit:
+            result_cache.put(cache_keys[filename], result, detected_line)
+        if annotation_store is not None and detected_line is not None:
+            # Cached results have no candidates; the selected line is still stored
+            annotation_store.append_detected_line(filename, detected_line, diameter, line_candidates)
+        if result_callback is not None:
+            finished_files.add(filename)
+            emit_finished_in_order()
+
+        completed_files += 1
         if progress_callback:
-            progress = (index + 1) / total_files * 100
-            progress_callback(progress)
-
-        elapsed_time = time.time() - start_time
-        estimated_total_time = elapsed_time / (index + 1) * total_files
-        remaining_time = estimated_total_time - elapsed_time
-
-        if angle is not None and contrast is not None:
-            results[filename] = {
-                'angle': angle,
-                'contrast': contrast,
-                'blurriness': blurriness
-            }
-
-        # Save the processed image
-        processed_image_path = os.path.join(output_folder, f"{Path(filename).stem}_processed.jpg")
-        if os.path.exists(processed_image_path):
-            os.remove(processed_image_path)
-        cv2.imwrite(processed_image_path, processed_image)
-
+            progress_callback(completed_files / total_files * 100)
+
+    pending_files = image_files
+    if result_cache is not None:
+        pending_files = []
+        parameters = get_analysis_parameters(**options)
+        for filename in image_files:
+            image_path = os.path.join(folder_path, filename)
+            key = result_cache.make_key(image_path, parameters)
+            cached = result_cache.get(key)
+            if cached is None:
+                cache_keys[filename] = key
+                pending_files.append(filename)
+                continue
+
+            result, detected_line = cached
+            processed_image = None
+            if write_overlays and not os.path.exists(get_processed_image_path(output_folder, filename)):
+                processed_image = redraw_processed_image(image_path, result, detected_line, diameter)
+            record(filename, result, detected_line, processed_image)
+
+    workers = min(resolve_worker_count(workers), len(pending_files))
+    if workers > 1:
+        encoded_jpeg_quality = jpeg_quality if write_overlays else None
+        parallel_auto_detection(
+            folder_path, pending_files, options, record, workers, chunk_size, encoded_jpeg_quality,
+            profile_directory, warm_start_fit
+        )
+    else:
+        edge_fitter = EdgeFitter(fit_max_iterations, warm_start_fit)
+        for filename in pending_files:
+            record(filename, *analyse_file(
+                folder_path, filename, profile_directory=profile_directory, edge_fitter=edge_fitter,
+                draw_overlay=write_overlays, **options
+            ))
+
+    if result_cache is not None:
+        result_cache.commit()
+
+    if owns_overlay_writer:
+        write_errors = overlay_writer.close()
+        if write_errors:
+            failed_paths = ", ".join(path for path, _ in write_errors)
+            raise OSError(f"Failed to write {len(write_errors)} processed images: {failed_paths}")
+
+    # Completion order is arbitrary; hand back the same ordering a serial run would produce
+    results = {filename: results[filename] for filename in image_files if filename in results}
     return results, output_folder
+
+
+def parallel_auto_detection(folder_path, image_files, options, record, workers, chunk_size, jpeg_quality,
+                            profile_directory=None, warm_start_fit=False):
+    chunk_size = max(1, chunk_size)
+    chunks = [image_files[start:start + chunk_size] for start in range(0, len(image_files), chunk_size)]
+    pending_chunks = iter(chunks)
+    # Keep a couple of chunks queued per worker so no process idles while the next submission is made
+    max_in_flight = workers * 2
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for chunk in islice(pending_chunks, max_in_flight):
+            in_flight.add(executor.submit(
+                analyse_file_chunk, folder_path, chunk, options, jpeg_quality, profile_directory, warm_start_fit
+            ))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for analysed_file in future.result():
+                    record(*analysed_file)
+
+                next_chunk = next(pending_chunks, None)
+                if next_chunk is not None:
+                    in_flight.add(executor.submit(
+                        analyse_file_chunk, folder_path, next_chunk, options, jpeg_quality, profile_directory,
+                        warm_start_fit
+                    ))
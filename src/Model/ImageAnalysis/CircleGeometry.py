@@ -0,0 +1,56 @@
+import numpy as np
+from functools import lru_cache
+
+# Diameter in pixels of the centred circle that is analysed, unless the circle_diameter setting says otherwise
+DEFAULT_DIAMETER = 236
+
+
+def make_read_only(*arrays):
+    # Cached arrays are shared between every image of the same size, so callers must not modify them
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
+@lru_cache(maxsize=32)
+def get_disk_mask(shape, radius):
+    # Disk centred at (radius, radius), i.e. the circle inside a crop taken around it
+    rows, cols = np.ogrid[:shape[0], :shape[1]]
+    mask, = make_read_only((rows - radius) ** 2 + (cols - radius) ** 2 < radius ** 2)
+    return mask
+
+
+@lru_cache(maxsize=32)
+def get_disk_pixels(shape, radius):
+    # Row-major, the order the original per-pixel loops visited the disk in
+    rows, cols = np.nonzero(get_disk_mask(shape, radius))
+    return make_read_only(rows, cols, rows * shape[1] + cols)
+
+
+class CircleGeometry:
+    def __init__(self, shape, diameter):
+        self.shape = tuple(shape[:2])
+        if not 2 <= diameter <= min(self.shape):
+            # A larger circle would make the crop start outside the image
+            raise ValueError(f"The circle diameter of {diameter} pixels does not fit in a "
+                             f"{self.shape[1]}x{self.shape[0]} image; set a diameter of at most {min(self.shape)}")
+        self.diameter = diameter
+        self.radius = diameter // 2
+        self.mid_x, self.mid_y = self.shape[1] // 2, self.shape[0] // 2
+        top, left = self.mid_y - self.radius, self.mid_x - self.radius
+        # The square around the circle; image[window] is the crop the line is detected in
+        self.window = (slice(top, top + 2 * self.radius), slice(left, left + 2 * self.radius))
+        self.mask = get_disk_mask((2 * self.radius, 2 * self.radius), self.radius)
+        crop_rows, crop_cols, _ = get_disk_pixels((2 * self.radius, 2 * self.radius), self.radius)
+        # Pixels inside the circle in full image coordinates, and their positions in the flattened image
+        self.ys, self.xs, self.flat_indices = make_read_only(
+            crop_rows + top, crop_cols + left, (crop_rows + top) * self.shape[1] + crop_cols + left
+        )
+
+    def pixels(self, image):
+        return image.reshape(-1)[self.flat_indices] if image.flags.c_contiguous else image[self.ys, self.xs]
+
+
+@lru_cache(maxsize=16)
+def get_circle_geometry(shape, diameter=DEFAULT_DIAMETER):
+    return CircleGeometry(shape, diameter)
@@ -0,0 +1,45 @@
+import numpy as np
+import cv2
+from PIL import Image
+
+from .CircleGeometry import make_read_only
+
+
+class ImageHandle:
+    # One image file, decoded at most once; every stage of an analysis reads the same grayscale array
+    def __init__(self, path, gray=None):
+        self.path = path
+        self.gray = gray
+
+    def get_gray(self):
+        # Read-only, so crops and other views of it can be handed out without copying
+        if self.gray is None:
+            with Image.open(self.path) as image:
+                self.gray, = make_read_only(np.asarray(image.convert('L')))
+        return self.gray
+
+    def get_size(self):
+        height, width = self.get_gray().shape
+        return width, height
+
+    def create_overlay_image(self):
+        # A new colour buffer per overlay, since a drawn overlay may still be queued for writing. Its three channels
+        # start out equal, so it is BGR or RGB depending on the order the caller's colours are given in
+        return cv2.cvtColor(self.get_gray(), cv2.COLOR_GRAY2BGR)
+
+    def get_preview(self, max_size=None, mode="L"):
+        if self.gray is not None and mode == "L":
+            image = Image.fromarray(self.gray)
+            full_size = image.size
+        else:
+            image = Image.open(self.path)
+            full_size = image.size
+            if max_size is not None:
+                # JPEGs are decoded straight at a reduced scale, which is far cheaper than decoding and then resizing
+                image.draft(mode, max_size)
+            image = image.convert(mode)
+        if max_size is not None:
+            image.thumbnail(max_size)
+        # The canvas maps clicks on the preview back to the full-resolution pixels through this size
+        image.info["full_size"] = full_size
+        return image
@@ -0,0 +1,99 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from .SingleImageAnalysis import SingleImageAnalysis
+from .RiseDistance import EdgeFitter
+from .ImageHandle import ImageHandle
+from .StageTimer import StageTimer
+from .CircleGeometry import DEFAULT_DIAMETER
+from .AutoAnalysis import polar_line_to_points
+
+"""
+ Analysis of given lines. An annotation is a (filename, line, is_object_lighter) tuple, where line is either the two
+ endpoints of a drawn line or a detected line as stored by the AnnotationStore. The same annotations can be applied
+ again to a whole folder, e.g. after a change to the analysis settings.
+"""
+
+
+def analyse_annotation(image_handle, line_points, is_object_lighter, diameter=DEFAULT_DIAMETER, edge_fitter=None):
+    timer = StageTimer()
+    with timer.stage("total"):
+        with timer.stage("decode"):
+            image_handle.get_gray()
+        contrast, angle, blurriness, line_overlay_image = SingleImageAnalysis(
+            image_handle, line_points, is_object_lighter, diameter, edge_fitter
+        ).get_analysis(timer)
+    result = {
+        'angle': angle,
+        'contrast': contrast,
+        'blurriness': blurriness
+    }
+    return result, line_overlay_image, timer.durations
+
+
+def get_line_points(image_handle, line):
+    if isinstance(line, dict):
+        # A detected line is (rho, theta) relative to the crop around the circle it was detected in
+        width, height = image_handle.get_size()
+        return polar_line_to_points([(line['rho'], line['theta'])], width // 2, height // 2, line['diameter'])
+    return line
+
+
+def analyse_annotation_chunk(folder_path, annotations, diameter=DEFAULT_DIAMETER, fit_max_iterations=None,
+                             jpeg_quality=None):
+    # Runs in a worker process; overlays are JPEG-encoded here so only compact bytes cross the process boundary
+    analysed = []
+    # Not warm-started, so every image gets the same result as when its line was first drawn
+    edge_fitter = EdgeFitter(fit_max_iterations, warm_start=False)
+    for filename, line, is_object_lighter in annotations:
+        image_handle = ImageHandle(os.path.join(folder_path, filename))
+        result, line_overlay_image, stage_durations = analyse_annotation(
+            image_handle, get_line_points(image_handle, line), is_object_lighter, diameter, edge_fitter
+        )
+        encoded_image = None
+        if jpeg_quality is not None:
+            buffer = io.BytesIO()
+            line_overlay_image.save(buffer, format="JPEG", quality=jpeg_quality)
+            encoded_image = buffer.getvalue()
+        analysed.append((filename, result, encoded_image, stage_durations))
+    return analysed
+
+
+def reanalyse_annotations(folder_path, annotations, record, diameter=DEFAULT_DIAMETER, fit_max_iterations=None,
+                          workers=1, chunk_size=4, jpeg_quality=None, progress_callback=None):
+    # record(filename, result, encoded_overlay, stage_durations) is called on this thread as each image finishes
+    annotations = list(annotations)
+    chunk_size = max(1, chunk_size)
+    chunks = [annotations[start:start + chunk_size] for start in range(0, len(annotations), chunk_size)]
+    completed = 0
+
+    def record_chunk(analysed):
+        nonlocal completed
+        for analysed_file in analysed:
+            record(*analysed_file)
+            completed += 1
+            if progress_callback:
+                progress_callback(completed / len(annotations) * 100)
+
+    workers = min(workers, len(chunks))
+    if workers <= 1:
+        for chunk in chunks:
+            record_chunk(analyse_annotation_chunk(folder_path, chunk, diameter, fit_max_iterations, jpeg_quality))
+        return
+
+    pending_chunks = iter(chunks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {
+            executor.submit(analyse_annotation_chunk, folder_path, chunk, diameter, fit_max_iterations, jpeg_quality)
+            for chunk in islice(pending_chunks, workers * 2)
+        }
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                record_chunk(future.result())
+                next_chunk = next(pending_chunks, None)
+                if next_chunk is not None:
+                    in_flight.add(executor.submit(
+                        analyse_annotation_chunk, folder_path, next_chunk, diameter, fit_max_iterations, jpeg_quality
+                    ))
@@ -0,0 +1,63 @@
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+
+
+def save_overlay_image(path, image, jpeg_quality=95):
+    if os.path.exists(path):
+        os.remove(path)
+
+    if isinstance(image, bytes):
+        # Already JPEG-encoded by a worker process
+        with open(path, 'wb') as file:
+            file.write(image)
+    elif isinstance(image, np.ndarray):
+        if not cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]):
+            raise OSError(f"Could not write {path}")
+    else:
+        image.save(path, quality=jpeg_quality)
+
+
+class OverlayWriter:
+    def __init__(self, max_queue_size=16, jpeg_quality=95, written_callback=None):
+        self.jpeg_quality = jpeg_quality
+        self.written_callback = written_callback
+        # A bounded queue makes write() block, so analysis cannot run arbitrarily far ahead of the disk
+        self.write_queue = queue.Queue(maxsize=max_queue_size)
+        self.errors = []
+        self.errors_lock = threading.Lock()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def write(self, path, image):
+        self.write_queue.put((path, image, self.jpeg_quality))
+
+    def run(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                self.write_queue.task_done()
+                break
+
+            path, image, jpeg_quality = item
+            try:
+                save_overlay_image(path, image, jpeg_quality)
+                if self.written_callback:
+                    self.written_callback(path)
+            except Exception as error:
+                with self.errors_lock:
+                    self.errors.append((path, error))
+            finally:
+                self.write_queue.task_done()
+
+    def flush(self):
+        self.write_queue.join()
+        with self.errors_lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        errors = self.flush()
+        self.write_queue.put(None)
+        return errors
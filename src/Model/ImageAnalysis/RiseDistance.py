@@ -1,7 +1,15 @@
 import numpy as np
-from collections import defaultdict
-from scipy.optimize import curve_fit
+from scipy.optimize import leastsq
 from scipy.special import erf
+from .StageTimer import NULL_TIMER
+
+FIT_TOLERANCE = 5e-10
+# The plateaus on either side of the edge are read from these percentiles of the ESF, so outlying bins are ignored
+PLATEAU_PERCENTILES = (5, 95)
+# Bins of the ESF averaged before looking for its steepest point
+GRADIENT_SMOOTHING_BINS = 5
+# Near the ends of the circle a bin holds a few pixels only; such bins are not taken as the edge position
+MIN_BIN_FRACTION = 0.25
 
 
 def slope_intercept_to_standard(slope, intercept):
@@ -17,38 +25,110 @@ def distance_from_point_line(point, line):
 
 
 def round_to_the_nearest_bin(n, sample_bins=4):
-    return round(n * sample_bins) / sample_bins
+    return np.round(np.multiply(n, sample_bins)) / sample_bins
 
 
-def edge_spread_function(image_array, line, radius):
-    bins = defaultdict(list)
-    mid_x, mid_y = np.shape(image_array)[1] // 2, np.shape(image_array)[0] // 2
+def edge_spread_function(image_array, line, geometry):
+    pixels = geometry.pixels(image_array)
+    distances = round_to_the_nearest_bin(
+        distance_from_point_line(point=(geometry.xs, geometry.ys), line=line),
+        sample_bins=2
+    )
 
-    for col in range(mid_x - radius, mid_x + radius):
-        for row in range(mid_y - radius, mid_y + radius):
-            if (col - mid_x) ** 2 + (row - mid_y) ** 2 < radius ** 2:
-                pixel = image_array[row, col]
-                distance = round_to_the_nearest_bin(
-                    distance_from_point_line(point=(col, row), line=line),
-                    sample_bins=2
-                )
-                bins[distance].append(pixel)
+    # Sort by bin then intensity so every bin is a contiguous, ordered run and its median can be read off directly
+    order = np.lexsort((pixels, distances))
+    distances, pixels = distances[order], pixels[order].astype(np.float64)
+    bin_centres, starts, counts = np.unique(distances, return_index=True, return_counts=True)
+    medians = (pixels[starts + (counts - 1) // 2] + pixels[starts + counts // 2]) / 2
 
-    esf = [(distance, np.median(pixels)) for distance, pixels in bins.items()]
-    return esf
+    return bin_centres, medians, counts
 
 
 def edge_model(x, a1, a3, sigma, a2):
     return a1 * erf((x - a3) / (sigma * np.sqrt(2))) + a2
 
 
-def rise_distance(image_array, line, radius):
-    esf = edge_spread_function(image_array, line, radius)
-    distances, pixels = zip(*esf)
-    distances = np.array(distances)
-    pixels = np.array(pixels)
-    initial_guesses = [np.max(pixels), np.mean(distances), 10, 10]
-    popt, _ = curve_fit(edge_model, distances, pixels, p0=initial_guesses, ftol=5e-10, xtol=5e-10)
-    sigma = abs(popt[2])
+def edge_model_jacobian(x, a1, a3, sigma, a2):
+    # One row per parameter, the layout MINPACK uses internally, so leastsq does not have to transpose it
+    scaled_distance = (x - a3) / (sigma * np.sqrt(2))
+    # Derivative of the model with respect to x; a3 and sigma enter the model only through scaled_distance
+    slope = a1 * np.sqrt(2 / np.pi) / sigma * np.exp(-scaled_distance ** 2)
+    jacobian = np.empty((4, len(x)))
+    jacobian[0] = erf(scaled_distance)
+    np.negative(slope, out=jacobian[1])
+    np.multiply(jacobian[1], (x - a3) / sigma, out=jacobian[2])
+    jacobian[3] = 1
+    return jacobian
+
+
+def estimate_edge_parameters(distances, pixels, counts):
+    ordered = np.sort(pixels)
+    low, high = (ordered[(len(ordered) - 1) * percentile // 100] for percentile in PLATEAU_PERCENTILES)
+
+    # Slopes between neighbouring bins of the smoothed ESF; sparsely filled bins are not taken as the edge position
+    half_window = GRADIENT_SMOOTHING_BINS // 2
+    inner = slice(half_window, len(distances) - half_window)
+    smoothed = np.convolve(pixels, np.ones(GRADIENT_SMOOTHING_BINS) / GRADIENT_SMOOTHING_BINS, mode='valid')
+    slopes = np.diff(smoothed) / np.diff(distances[inner])
+    positions = (distances[inner][:-1] + distances[inner][1:]) / 2
+    filled = np.minimum(counts[inner][:-1], counts[inner][1:]) >= MIN_BIN_FRACTION * np.max(counts)
+    if filled.any():
+        slopes, positions = slopes[filled], positions[filled]
+    steepest = int(np.argmax(np.abs(slopes)))
+
+    amplitude = (high - low) / 2 if slopes[steepest] >= 0 else (low - high) / 2
+    # The steepest slope of a1 * erf(x / (sigma * sqrt(2))) is a1 * sqrt(2 / pi) / sigma
+    span = distances[-1] - distances[0]
+    sigma = abs(amplitude) * np.sqrt(2 / np.pi) / abs(slopes[steepest]) if slopes[steepest] else span / 4
+    return [amplitude, positions[steepest], float(np.clip(sigma, 0.25, span)), (high + low) / 2]
+
+
+class EdgeFitter:
+    def __init__(self, max_iterations=None, warm_start=False):
+        # With a budget the fit stops after that many model evaluations and keeps its estimate so far
+        self.max_iterations = max_iterations
+        self.warm_start = warm_start
+        self.previous_parameters = None
+
+    def get_initial_guesses(self, distances, pixels, counts):
+        initial_guesses = estimate_edge_parameters(distances, pixels, counts)
+        # Consecutive captures share the optics, so the edge width can carry over; levels and position are re-estimated.
+        # The result then depends on which image was fitted before, so this is off unless asked for
+        if self.warm_start and self.previous_parameters is not None:
+            initial_guesses[2] = abs(self.previous_parameters[2])
+        return initial_guesses
+
+    def fit(self, distances, pixels, counts):
+        # Too few bins to estimate the edge from, let alone fit its four parameters
+        if len(distances) <= GRADIENT_SMOOTHING_BINS:
+            return None
+
+        parameters, _, _, _, status = leastsq(
+            lambda parameters: edge_model(distances, *parameters) - pixels,
+            self.get_initial_guesses(distances, pixels, counts),
+            Dfun=lambda parameters: edge_model_jacobian(distances, *parameters), col_deriv=True,
+            full_output=True, ftol=FIT_TOLERANCE, xtol=FIT_TOLERANCE, maxfev=self.max_iterations or 0
+        )
+        # Status 5 means the evaluation budget ran out, which is only acceptable when the budget was asked for
+        converged = status in (1, 2, 3, 4) or (status == 5 and self.max_iterations)
+        # Without a step (a1 = 0) or with zero width the fitted sigma means nothing
+        if not converged or not np.all(np.isfinite(parameters)) or parameters[0] == 0 or parameters[2] == 0:
+            return None
+
+        self.previous_parameters = parameters
+        return parameters
+
+
+def rise_distance(image_array, line, geometry, timer=NULL_TIMER, edge_fitter=None):
+    # A fit that does not converge gives NaN, so one bad image does not abort a whole folder
+    if edge_fitter is None:
+        edge_fitter = EdgeFitter()
+    with timer.stage("edge_spread_function"):
+        distances, pixels, counts = edge_spread_function(image_array, line, geometry)
+    with timer.stage("curve_fit"):
+        parameters = edge_fitter.fit(distances, pixels, counts)
+    if parameters is None:
+        return np.nan
+    sigma = abs(parameters[2])
 
     return sigma
@@ -2,41 +2,51 @@ import numpy as np
 from PIL import Image
 import cv2
 from .RiseDistance import rise_distance
+from .StageTimer import NULL_TIMER
+from .CircleGeometry import DEFAULT_DIAMETER, get_circle_geometry
 
 
-def calculate_image_property_from_cartesian_coordinate(image, line_points, mid_x, mid_y, diameter, is_object_lighter):
+def line_points_to_slope_intercept(line_points):
+    (x1, y1), (x2, y2) = line_points
+    slope = (y2 - y1) / ((x2 - x1) + 1e-9)
+    intercept = y1 - slope * x1
+    return slope, intercept
+
+
+def calculate_image_property_from_cartesian_coordinate(image, line_points, diameter, is_object_lighter,
+                                                       timer=NULL_TIMER, edge_fitter=None):
     (x1, y1), (x2, y2) = line_points
     dx = x2 - x1
     dy = y2 - y1
 
     is_horizontal = abs(dx) > abs(dy)
 
-    slope = dy / (dx + 1e-9)
-    intercept = y1 - slope * x1
+    slope, intercept = line_points_to_slope_intercept(line_points)
 
-    radius = diameter // 2
-    side1_pixels = []
-    side2_pixels = []
-
-    for x in range(mid_x - radius, mid_x + radius):
-        for y in range(mid_y - radius, mid_y + radius):
-            if (x - mid_x) ** 2 + (y - mid_y) ** 2 < radius ** 2:
-                line_y = slope * x + intercept if is_horizontal else (y - intercept) / slope if slope != 0 else x
-                distance = (y - line_y) if is_horizontal else (x - line_y)
-                pixel_value = image[y, x]
-                if distance >= 0:
-                    side1_pixels.append(pixel_value)
-                else:
-                    side2_pixels.append(pixel_value)
-
-    p1 = np.mean(side1_pixels) if side1_pixels else 0
-    p2 = np.mean(side2_pixels) if side2_pixels else 0
-    contrast = abs((p2 - p1) / (p2 + p1)) if (p2 + p1) != 0 else 0
+    geometry = get_circle_geometry(image.shape, diameter)
+    with timer.stage("contrast"):
+        xs, ys = geometry.xs, geometry.ys
+
+        if is_horizontal:
+            distances = ys - (slope * xs + intercept)
+        elif slope != 0:
+            distances = xs - (ys - intercept) / slope
+        else:
+            distances = np.zeros(xs.shape)
+
+        # Pixel sums are integers well below 2**53, so sum / count equals np.mean bit for bit
+        sides = (distances >= 0).astype(np.intp)
+        side_sums = np.bincount(sides, weights=geometry.pixels(image), minlength=2)
+        side_counts = np.bincount(sides, minlength=2)
+        p1 = side_sums[1] / side_counts[1] if side_counts[1] else 0
+        p2 = side_sums[0] / side_counts[0] if side_counts[0] else 0
+        contrast = abs((p2 - p1) / (p2 + p1)) if (p2 + p1) != 0 else 0
 
     angle = np.arctan(slope) * 180 / np.pi
     darker_side_on_left_or_above = p1 > p2
 
-    blurriness = rise_distance(image_array=image, line=(slope, intercept), radius=diameter // 2)
+    blurriness = rise_distance(image_array=image, line=(slope, intercept), geometry=geometry, timer=timer,
+                               edge_fitter=edge_fitter)
     darker_side_on_left_or_above = (darker_side_on_left_or_above == (not is_object_lighter))
 
     if is_horizontal:
@@ -58,35 +68,35 @@ def calculate_image_property_from_cartesian_coordinate(image, line_points, mid_x
 
 
 class SingleImageAnalysis:
-    def __init__(self, image, line_points, is_object_lighter, diameter=236):
-        self.image = image
+    def __init__(self, image_handle, line_points, is_object_lighter, diameter=DEFAULT_DIAMETER, edge_fitter=None):
+        self.image_handle = image_handle
         self.line_points = line_points
         self.diameter = diameter
+        self.edge_fitter = edge_fitter
         self.is_object_lighter = is_object_lighter
 
     def draw_line_and_text_from_cartesian_coordinate(self, image, line_points, angle, contrast, blurriness,
                                                      color=(0, 0, 255)):
         (x1, y1), (x2, y2) = line_points
         cv2.line(image, (x1, y1), (x2, y2), color, 2)
-        mid_x, mid_y = self.image.size[0] // 2, self.image.size[1] // 2
+        mid_x, mid_y = self.image_handle.get_size()[0] // 2, self.image_handle.get_size()[1] // 2
         cv2.circle(image, (mid_x, mid_y), self.diameter // 2, (0, 255, 0), 2)
         info_text = f'Angle: {angle:.3f} deg, Contrast: {contrast:.3f}, Blurriness: {blurriness:.5f}'
         cv2.putText(image, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (147, 155, 26), 2)
 
-    def get_analysis(self):
-        line_overlay_image = self.image.copy()
-        line_overlay_image_np = np.array(line_overlay_image)
-        mid_x, mid_y = line_overlay_image.size[0] // 2, line_overlay_image.size[1] // 2
-
+    def get_analysis(self, timer=NULL_TIMER):
         # Calculate properties using Cartesian coordinates
-        angle, contrast, blurriness = calculate_image_property_from_cartesian_coordinate(line_overlay_image_np,
+        angle, contrast, blurriness = calculate_image_property_from_cartesian_coordinate(self.image_handle.get_gray(),
                                                                                          self.line_points,
-                                                                                         mid_x, mid_y, self.diameter,
-                                                                                         self.is_object_lighter)
+                                                                                         self.diameter,
+                                                                                         self.is_object_lighter,
+                                                                                         timer, self.edge_fitter)
 
-        line_overlay_image_color = cv2.cvtColor(line_overlay_image_np, cv2.COLOR_BGR2RGB)
-        self.draw_line_and_text_from_cartesian_coordinate(line_overlay_image_color, self.line_points, angle,
-                                                          contrast, blurriness, self.diameter)
+        with timer.stage("overlay"):
+            # The colours below are RGB, as the buffer is handed to PIL
+            line_overlay_image_color = self.image_handle.create_overlay_image()
+            self.draw_line_and_text_from_cartesian_coordinate(line_overlay_image_color, self.line_points, angle,
+                                                              contrast, blurriness, self.diameter)
 
-        line_overlay_image_pil = Image.fromarray(line_overlay_image_color)
+            line_overlay_image_pil = Image.fromarray(line_overlay_image_color)
         return contrast, angle, blurriness, line_overlay_image_pil
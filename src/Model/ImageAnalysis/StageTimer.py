@@ -0,0 +1,139 @@
+import csv
+import time
+import bisect
+import threading
+import cProfile
+from contextlib import contextmanager, nullcontext
+
+STAGES = (
+    "decode", "gaussian_blur", "crop", "pyramid", "segmentation", "canny", "hough", "line_selection",
+    "refinement", "contrast", "edge_spread_function", "curve_fit", "overlay", "total"
+)
+
+
+class StageTimer:
+    def __init__(self):
+        self.durations = dict()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+
+class NullStageTimer:
+    def stage(self, name):
+        return nullcontext()
+
+
+NULL_TIMER = NullStageTimer()
+
+
+@contextmanager
+def profiled(profile_path):
+    if profile_path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+def get_percentile(sorted_values, percentile):
+    # Linear interpolation between the closest ranks, as numpy.percentile does by default
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class RunTimings:
+    def __init__(self):
+        # Auto detection and manual analyses add timings from their own threads while the status bar reads them
+        self.lock = threading.Lock()
+        self.per_image = dict()
+        # Every stage's durations, kept sorted as images are added, so a summary needs no pass over all images
+        self.sorted_durations = dict()
+        self.summary = None
+
+    def add(self, filename, durations):
+        if not durations:
+            return
+        with self.lock:
+            # An image analysed again, e.g. with a new line, replaces its earlier timings
+            for stage, duration in self.per_image.get(filename, dict()).items():
+                values = self.sorted_durations[stage]
+                del values[bisect.bisect_left(values, duration)]
+                if not values:
+                    del self.sorted_durations[stage]
+            for stage, duration in durations.items():
+                bisect.insort(self.sorted_durations.setdefault(stage, []), duration)
+            self.per_image[filename] = dict(durations)
+            self.summary = None
+
+    def clear(self):
+        with self.lock:
+            self.per_image = dict()
+            self.sorted_durations = dict()
+            self.summary = None
+
+    def get_stage_names(self):
+        with self.lock:
+            recorded = set(self.sorted_durations)
+        return [stage for stage in STAGES if stage in recorded] + sorted(recorded - set(STAGES))
+
+    def summarize(self):
+        stage_names = self.get_stage_names()
+        with self.lock:
+            # Computed again only after timings were added
+            if self.summary is None:
+                self.summary = dict()
+                for stage in stage_names:
+                    values = self.sorted_durations[stage]
+                    self.summary[stage] = {
+                        'count': len(values),
+                        'p50': get_percentile(values, 50),
+                        'p95': get_percentile(values, 95),
+                        'max': values[-1],
+                    }
+            return {stage: dict(stats) for stage, stats in self.summary.items()}
+
+    def format_status(self):
+        summary = self.summarize()
+        if 'total' not in summary:
+            return None
+
+        total = summary.pop('total')
+        status = (f"Per image: p50 {total['p50'] * 1000:.0f} ms, p95 {total['p95'] * 1000:.0f} ms, "
+                  f"max {total['max'] * 1000:.0f} ms")
+        if summary:
+            slowest_stage = max(summary, key=lambda stage: summary[stage]['p50'])
+            status += f" (slowest: {slowest_stage} {summary[slowest_stage]['p50'] * 1000:.0f} ms)"
+        return status
+
+    def export_summary_csv(self, path_to_file):
+        with open(path_to_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['stage', 'count', 'p50_ms', 'p95_ms', 'max_ms'])
+            for stage, stats in self.summarize().items():
+                writer.writerow([stage, stats['count'], stats['p50'] * 1000, stats['p95'] * 1000, stats['max'] * 1000])
+
+    def export_per_image_csv(self, path_to_file):
+        stages = self.get_stage_names()
+        with self.lock:
+            per_image = list(self.per_image.items())
+        with open(path_to_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['file'] + [f"{stage}_ms" for stage in stages])
+            for filename, durations in per_image:
+                writer.writerow([filename] + [
+                    durations[stage] * 1000 if stage in durations else '' for stage in stages
+                ])
@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+
+
+class ProcessedIndex:
+    def __init__(self):
+        self.folder = None
+        self.mtimes = dict()
+
+    @staticmethod
+    def get_processed_filename(filename):
+        return f"{Path(filename).stem}_processed.jpg"
+
+    def load(self, folder):
+        self.folder = folder
+        self.mtimes = dict()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith("_processed.jpg") and entry.is_file():
+                    self.mtimes[entry.name] = entry.stat().st_mtime
+
+    def add(self, processed_image_path):
+        processed_filename = os.path.basename(processed_image_path)
+        try:
+            self.mtimes[processed_filename] = os.stat(processed_image_path).st_mtime
+        except OSError:
+            self.mtimes.pop(processed_filename, None)
+
+    def lookup(self, filename):
+        # Indexed entries are re-stat'ed on lookup so overlays deleted outside the app are noticed
+        processed_filename = self.get_processed_filename(filename)
+        if self.folder is None or processed_filename not in self.mtimes:
+            return None
+
+        processed_image_path = os.path.join(self.folder, processed_filename)
+        try:
+            mtime = os.stat(processed_image_path).st_mtime
+        except OSError:
+            self.mtimes.pop(processed_filename, None)
+            return None
+
+        self.mtimes[processed_filename] = mtime
+        return processed_image_path, mtime
+
+    def clear(self):
+        self.folder = None
+        self.mtimes = dict()
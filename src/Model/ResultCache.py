@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+
+class ResultCache:
+    def __init__(self, directory, max_entries=100000):
+        self.directory = directory
+        # Rows have a fixed size, so the cache is bounded by its number of results; see result_cache_max_entries
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pending_writes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # auto_detection runs on a worker thread, not the thread that created the model
+        self.connection = sqlite3.connect(os.path.join(directory, "results.sqlite"), check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, angle REAL, contrast REAL, blurriness REAL, "
+            "rho REAL, theta REAL, last_access REAL)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(image_path, parameters):
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(json.dumps(parameters, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT angle, contrast, blurriness, rho, theta FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.connection.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        angle, contrast, blurriness, rho, theta = row
+        result = None
+        if angle is not None and contrast is not None:
+            # SQLite stores the NaN of a failed edge fit as NULL
+            result = {
+                'angle': angle,
+                'contrast': contrast,
+                'blurriness': blurriness if blurriness is not None else float('nan')
+            }
+        detected_line = (rho, theta) if rho is not None else None
+        return result, detected_line
+
+    def put(self, key, result, detected_line):
+        angle, contrast, blurriness = (None, None, None)
+        if result is not None:
+            angle, contrast, blurriness = result['angle'], result['contrast'], result['blurriness']
+        rho, theta = detected_line if detected_line is not None else (None, None)
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, angle, contrast, blurriness, rho, theta, time.time())
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= 64:
+            self.commit()
+
+    def commit(self):
+        self.evict()
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,212 @@
+import os
+import time
+import shutil
+import threading
+import numpy as np
+
+# One raw little-endian file per column; rows are only ever appended, and the last row for a file wins
+COLUMNS = (
+    ('file_id', '<u4'),
+    ('angle', '<f8'),
+    ('contrast', '<f8'),
+    ('blurriness', '<f8'),
+)
+VALUE_COLUMNS = ('angle', 'contrast', 'blurriness')
+FILENAMES_FILE = "filenames.txt"
+
+
+def get_result_store_directory(output_processed_folder):
+    return os.path.join(output_processed_folder, "analysis_store")
+
+
+def get_column_path(directory, name):
+    return os.path.join(directory, f"{name}.bin")
+
+
+class StoredResults:
+    def __init__(self, filenames, columns):
+        self.filenames = filenames
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.filenames)
+
+    @staticmethod
+    def from_analysis(analysis):
+        columns = {
+            name: np.fromiter((data[name] for data in analysis.values()), dtype=np.float64, count=len(analysis))
+            for name in VALUE_COLUMNS
+        }
+        return StoredResults(list(analysis), columns)
+
+    def to_analysis(self):
+        return {
+            filename: {'angle': angle, 'contrast': contrast, 'blurriness': blurriness}
+            for filename, angle, contrast, blurriness in zip(
+                self.filenames, *(self.columns[name].tolist() for name in VALUE_COLUMNS)
+            )
+        }
+
+    def select(self, filenames):
+        keep = np.fromiter((filename in filenames for filename in self.filenames), dtype=bool, count=len(self))
+        return StoredResults(
+            [filename for filename, kept in zip(self.filenames, keep) if kept],
+            {name: column[keep] for name, column in self.columns.items()}
+        )
+
+    def iter_rows(self):
+        for filename, angle, contrast, blurriness in zip(
+                self.filenames, *(self.columns[name].tolist() for name in VALUE_COLUMNS)):
+            yield {'angle': angle, 'contrast': contrast, 'blurriness': blurriness, 'file': filename}
+
+    def to_mat_columns(self):
+        return {**{name: self.columns[name] for name in VALUE_COLUMNS}, 'file': self.filenames}
+
+
+class ResultStore:
+    def __init__(self, directory, flush_interval=2.0, flush_rows=256):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        # auto_detection records results on a worker thread while manual analyses arrive on the Tk thread
+        self.lock = threading.Lock()
+        self.filenames = []
+        self.file_ids = dict()
+        self.pending_filenames = []
+        self.pending_rows = []
+        self.last_flush = time.monotonic()
+
+        compacting_directory = f"{directory}.compact"
+        if not os.path.isdir(directory) and os.path.isdir(compacting_directory):
+            os.replace(compacting_directory, directory)
+        os.makedirs(directory, exist_ok=True)
+        self.load_filenames()
+        self.truncate_to_complete_rows()
+
+    def load_filenames(self):
+        path = os.path.join(self.directory, FILENAMES_FILE)
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as file:
+            content = file.read()
+        # A name without its trailing newline was cut off by a crash and is dropped
+        complete_length = content.rfind(b'\n') + 1
+        if complete_length < len(content):
+            with open(path, 'r+b') as file:
+                file.truncate(complete_length)
+        self.filenames = content[:complete_length].decode('utf-8').split('\n')[:-1]
+        self.file_ids = {filename: file_id for file_id, filename in enumerate(self.filenames)}
+
+    def truncate_to_complete_rows(self):
+        # Columns are appended one after another, so a crash can leave them with different lengths
+        row_count = self.get_row_count()
+        for name, dtype in COLUMNS:
+            path = get_column_path(self.directory, name)
+            if os.path.exists(path) and os.path.getsize(path) != row_count * np.dtype(dtype).itemsize:
+                with open(path, 'r+b') as file:
+                    file.truncate(row_count * np.dtype(dtype).itemsize)
+
+    def get_row_count(self):
+        row_counts = []
+        for name, dtype in COLUMNS:
+            path = get_column_path(self.directory, name)
+            row_counts.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        return min(row_counts)
+
+    def append(self, filename, result):
+        # A result of None is stored as a NaN row, which removes any earlier result for the file
+        with self.lock:
+            file_id = self.file_ids.get(filename)
+            if file_id is None:
+                file_id = len(self.filenames)
+                self.filenames.append(filename)
+                self.file_ids[filename] = file_id
+                self.pending_filenames.append(filename)
+
+            if result is None:
+                self.pending_rows.append((file_id, np.nan, np.nan, np.nan))
+            else:
+                self.pending_rows.append((file_id, result['angle'], result['contrast'], result['blurriness']))
+
+            if (len(self.pending_rows) >= self.flush_rows
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.write_pending()
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self):
+        self.last_flush = time.monotonic()
+        if not self.pending_rows and not self.pending_filenames:
+            return
+
+        # Names are written before the rows that refer to them
+        if self.pending_filenames:
+            with open(os.path.join(self.directory, FILENAMES_FILE), 'a', encoding='utf-8', newline='\n') as file:
+                file.write("".join(f"{filename}\n" for filename in self.pending_filenames))
+            self.pending_filenames = []
+
+        rows = list(zip(*self.pending_rows))
+        for (name, dtype), values in zip(COLUMNS, rows):
+            with open(get_column_path(self.directory, name), 'ab') as file:
+                file.write(np.asarray(values, dtype=dtype).tobytes())
+        self.pending_rows = []
+
+    def read_columns(self):
+        row_count = self.get_row_count()
+        return {
+            name: np.fromfile(get_column_path(self.directory, name), dtype=dtype, count=row_count)
+            if row_count else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS
+        }
+
+    def read(self):
+        self.flush()
+        with self.lock:
+            columns = self.read_columns()
+            filenames = list(self.filenames)
+
+        file_ids = columns['file_id']
+        # Files keep the position of their first row and take the values of their last one
+        unique_ids, first_rows = np.unique(file_ids, return_index=True)
+        _, last_rows_reversed = np.unique(file_ids[::-1], return_index=True)
+        last_rows = len(file_ids) - 1 - last_rows_reversed
+        order = np.argsort(first_rows, kind='stable')
+        unique_ids, last_rows = unique_ids[order], last_rows[order]
+
+        live = ~np.isnan(columns['angle'][last_rows])
+        unique_ids, last_rows = unique_ids[live], last_rows[live]
+        return StoredResults(
+            [filenames[file_id] for file_id in unique_ids.tolist()],
+            {name: columns[name][last_rows] for name in VALUE_COLUMNS}
+        )
+
+    def compact(self):
+        # Rewrites the store with one row per file; the new copy is swapped in only once fully written
+        results = self.read()
+        with self.lock:
+            if len(results) * 2 >= self.get_row_count():
+                return
+
+            compacting_directory = f"{self.directory}.compact"
+            shutil.rmtree(compacting_directory, ignore_errors=True)
+            os.makedirs(compacting_directory)
+            with open(os.path.join(compacting_directory, FILENAMES_FILE), 'w', encoding='utf-8', newline='\n') as file:
+                file.write("".join(f"{filename}\n" for filename in results.filenames))
+            np.arange(len(results), dtype=COLUMNS[0][1]).tofile(get_column_path(compacting_directory, 'file_id'))
+            for name, dtype in COLUMNS[1:]:
+                results.columns[name].astype(dtype).tofile(get_column_path(compacting_directory, name))
+
+            replaced_directory = f"{self.directory}.old"
+            shutil.rmtree(replaced_directory, ignore_errors=True)
+            os.replace(self.directory, replaced_directory)
+            os.replace(compacting_directory, self.directory)
+            shutil.rmtree(replaced_directory, ignore_errors=True)
+
+            self.filenames = list(results.filenames)
+            self.file_ids = {filename: file_id for file_id, filename in enumerate(self.filenames)}
+
+    def close(self):
+        self.flush()
@@ -1,16 +1,47 @@
 import os
 import json
 
+from .ImageAnalysis.CircleGeometry import DEFAULT_DIAMETER
+
 
 class Settings:
+    DEFAULT_VALUES = {
+        "analysis_export_path": ".",
+        "export_to_csv": True,
+        "export_to_excel": True,
+        "export_to_mat": True,
+        "run_auto_detection": True,
+        "use_vectorized_kmeans": True,
+        "detection_mode": "standard",
+        "segmentation_backend": "kmeans",
+        "circle_diameter": DEFAULT_DIAMETER,
+        "edge_fit_max_iterations": 0,
+        "edge_fit_warm_start": False,
+        "line_vote_weight": 0.0,
+        "line_angle_prior": None,
+        "line_angle_weight": 0.0,
+        "auto_detection_workers": 0,
+        "auto_detection_chunk_size": 4,
+        "use_result_cache": False,
+        "result_cache_directory": "result_cache",
+        # A number of results, not bytes; each takes about 180 bytes on disk, so 100000 is roughly 18 MB
+        "result_cache_max_entries": 100000,
+        "use_frame_cache": False,
+        "frame_cache_max_mb": 2048,
+        "watch_folder": False,
+        "watch_interval_seconds": 2.0,
+        "image_cache_memory_mb": 512,
+        "image_prefetch_count": 3,
+        "write_overlays": True,
+        "overlay_jpeg_quality": 95,
+        "overlay_write_queue_size": 16,
+        "profile_analysis": False,
+        "persist_results": True,
+        "result_store_flush_seconds": 2.0
+    }
+
     def __init__(self):
-        self.values = {
-            "analysis_export_path": ".",
-            "export_to_csv": True,
-            "export_to_excel": True,
-            "export_to_mat": True,
-            "run_auto_detection": True
-        }
+        self.values = dict(Settings.DEFAULT_VALUES)
         self.settings_file = "settings.json"
         if os.path.exists(self.settings_file):
             self.load_settings()
@@ -29,7 +60,7 @@ class Settings:
 
     def load_settings(self):
         with open(self.settings_file, 'r') as file:
-            self.values = json.load(file)
+            self.values.update(json.load(file))
 
     def export_settings(self):
         with open(self.settings_file, 'w') as file:
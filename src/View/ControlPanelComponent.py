@@ -1,3 +1,4 @@
+from math import isnan
 from tkinter import Frame, Button, font, Checkbutton, BooleanVar, Label
 
 
@@ -5,7 +6,7 @@ class ControlPanelComponent(Frame):
 
     # TODO: Break each component to smaller one
     def __init__(self, master, load_folder_callback, export_analysis_callback,
-                 open_settings_callback, on_checkbox_toggle):
+                 open_settings_callback, on_checkbox_toggle, reanalyse_callback):
         super().__init__(master, bg='black')
 
         # Font and button styling
@@ -27,6 +28,10 @@ class ControlPanelComponent(Frame):
                                              **button_style)
         self.export_analysis_button.pack(side="left", pady=5)
 
+        # Re-analyse Button
+        self.reanalyse_button = Button(left_frame, text="Re-analyse", command=reanalyse_callback, **button_style)
+        self.reanalyse_button.pack(side="left", pady=5)
+
         # Settings Button
         self.settings_button = Button(left_frame, text="Settings", command=open_settings_callback, **button_style)
         self.settings_button.pack(side="left", pady=5)
@@ -65,11 +70,22 @@ class ControlPanelComponent(Frame):
                                                       fg='white', bg='black')
         self.is_object_lighter_checkbox.pack(side="top")
 
+    def set_reanalyse_enabled(self, enabled):
+        self.reanalyse_button.config(state="normal" if enabled else "disabled")
+
     def update_checkbox_state(self, is_lighter):
         self.is_object_lighter_var.set(is_lighter)
 
-    def update_image_info(self, blurriness=None, contrast=None, angle=None):
+    def update_image_info(self, blurriness=None, contrast=None, angle=None, pending=False):
+        if pending:
+            # The line drawn on this image is still being analysed
+            for value_label in (self.blurriness_value, self.contrast_value, self.angle_value):
+                value_label.config(text="Analysing...")
+            return
         blurriness_str = f"{blurriness:.5f}" if blurriness else "N/A"
+        if blurriness is not None and isnan(blurriness):
+            # The edge model could not be fitted to this image
+            blurriness_str = "Fit failed"
         contrast_str = f"{contrast:.3f}" if contrast else "N/A"
         angle_str = f"{angle:.3f}" if angle else "N/A"
         self.blurriness_value.config(text=blurriness_str)
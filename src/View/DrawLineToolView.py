@@ -3,9 +3,13 @@ from .ControlPanelComponent import ControlPanelComponent
 from .BottomMenu import BottomMenu
 from .ImageCanvas import ImageCanvas
 from .SettingsPopupComponent import SettingsPopupComponent
+import queue
 import threading
 import time
 
+# How often the Tk thread runs the calls queued by background threads
+BACKGROUND_CALL_INTERVAL_MS = 50
+
 
 class MainView:
     def __init__(self, master, view_model):
@@ -14,7 +18,8 @@ class MainView:
 
         # Initialize components
         self.control_panel = ControlPanelComponent(master, self.load_folder, self.export_analysis,
-                                                   self.open_settings, self.on_checkbox_toggle)
+                                                   self.open_settings, self.on_checkbox_toggle,
+                                                   self.reanalyse_annotations)
         self.control_panel.pack(side="top", fill="x")
 
         self.bottom_menu = BottomMenu(master, self.prev_image, self.next_image)
@@ -23,10 +28,34 @@ class MainView:
         self.image_canvas = ImageCanvas(master, self.on_image_click, self.view_model)
         self.image_canvas.pack(expand=True, fill="both")
 
+        # Background threads never call Tk themselves: the Tk thread waits for some of them, e.g. when the folder
+        # watcher is stopped, and a Tk call from another thread would then wait for it in turn
+        self.background_calls = queue.Queue()
+        self.run_background_calls()
+
+        # Drawn lines are analysed on a worker thread; the result is shown on the Tk thread
+        self.view_model.analysis_done_callback = (
+            lambda filename, error: self.call_from_background(self.on_manual_analysis_done, filename, error)
+        )
+        self.view_model.file_index_callback = lambda: self.call_from_background(self.on_file_index_update)
+
         self.master.bind('<Left>', self.prev_image)
         self.master.bind('<Right>', self.next_image)
         self.master.bind('<Escape>', self.clear_clicked_points)
 
+    def call_from_background(self, function, *args):
+        self.background_calls.put((function, args))
+
+    def run_background_calls(self):
+        # Scheduled first, so a call that raises does not stop the ones after it
+        self.master.after(BACKGROUND_CALL_INTERVAL_MS, self.run_background_calls)
+        while True:
+            try:
+                function, args = self.background_calls.get_nowait()
+            except queue.Empty:
+                break
+            function(*args)
+
     def update_image_info(self):
         image_info = self.view_model.get_current_image_info()
         self.control_panel.update_image_info(**image_info)
@@ -41,23 +70,78 @@ class MainView:
         self.control_panel.update_checkbox_state(self.view_model.is_object_lighter)
         self.update_status("Loading...")
 
+        try:
+            # Returns as soon as the first image is found; the rest of the folder is indexed in the background
+            self.view_model.open_directory(directory)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            self.view_model.reset_state()
+            self.reset_view_state()
+            return
+        self.finalize_directory_loading()
+
         if self.view_model.get_option("run_auto_detection"):
-            threading.Thread(target=self.run_auto_detection, args=(directory,), daemon=True).start()
-            self.finalize_directory_loading()
+            threading.Thread(target=self.run_auto_detection, daemon=True).start()
         else:
-            self.load_directory_without_auto_detection(directory)
+            self.start_folder_watch()
 
         self.update_image_info()
 
     def export_analysis(self):
         try:
-            self.view_model.model.export_analysis()
-            messagebox.showinfo("Success", "Analysis exported successfully")
+            # The files are written on a background thread; the result is reported back on the Tk thread
+            self.view_model.model.export_analysis(
+                lambda error: self.call_from_background(self.on_export_finished, error)
+            )
         except ValueError as e:
             messagebox.showerror("Error", str(e))
+            self.view_model.reset_state()
+            self.reset_view_state()
+            return
 
         self.view_model.reset_state()
         self.reset_view_state()
+        self.update_status("Exporting...")
+
+    def reanalyse_annotations(self):
+        if not self.view_model.is_folder_loaded():
+            messagebox.showwarning("No Folder", "Load a folder before re-analysing its drawn lines.")
+            return
+        # Applies every stored line of the folder again with the current settings, off the Tk thread
+        self.control_panel.set_reanalyse_enabled(False)
+        self.update_status("Re-analysing...")
+        self.start_time = time.time()
+        threading.Thread(target=self.run_reanalysis, daemon=True).start()
+
+    def run_reanalysis(self):
+        try:
+            results = self.view_model.reanalyse_annotations(
+                lambda progress: self.call_from_background(self.update_progress, progress)
+            )
+        except Exception as e:
+            self.call_from_background(self.on_reanalysis_finished, None, e)
+            return
+        self.call_from_background(self.on_reanalysis_finished, results, None)
+
+    def on_reanalysis_finished(self, results, error):
+        self.control_panel.set_reanalyse_enabled(True)
+        if error is not None:
+            messagebox.showerror("Error", f"Re-analysis failed: {error}")
+        if not self.view_model.is_folder_loaded():
+            return
+        self.image_canvas.display_image(self.view_model.get_image_to_display())
+        self.update_status()
+        self.update_image_info()
+        if error is None:
+            messagebox.showinfo("Success", f"Re-analysed {len(results)} drawn lines")
+
+    def on_export_finished(self, error):
+        if not self.view_model.is_folder_loaded():
+            self.update_status()
+        if error is None:
+            messagebox.showinfo("Success", "Analysis exported successfully")
+        else:
+            messagebox.showerror("Error", f"Export failed: {error}")
 
     def reset_view_state(self):
         self.image_canvas.clear_image_set()
@@ -85,6 +169,13 @@ class MainView:
             self.control_panel.update_checkbox_state(self.view_model.is_object_lighter)
             self.update_image_info()
 
+    def on_manual_analysis_done(self, filename, error):
+        if error is not None:
+            messagebox.showerror("Error", f"Analysis of {filename} failed: {error}")
+        if self.view_model.is_folder_loaded():
+            self.update_status()
+            self.update_image_info()
+
     def update_status(self, message=None):
         if message:
             status = message
@@ -94,6 +185,20 @@ class MainView:
                 total_files = self.view_model.get_number_of_files()
                 processed_images_count = len(self.view_model.model.analysis)
                 status = f" File: {current_file}  | {self.view_model.model.current_file_index + 1}/{total_files}  |   {processed_images_count} images processed"
+                cache_stats = self.view_model.get_result_cache_stats()
+                if cache_stats is not None:
+                    status += f"  |   Cache: {cache_stats[0]} hits, {cache_stats[1]} misses"
+                stage_timing_status = self.view_model.get_stage_timing_status()
+                if stage_timing_status is not None:
+                    status += f"  |   {stage_timing_status}"
+                if not self.view_model.is_file_index_complete():
+                    status += "  |   Indexing folder..."
+                write_error_count = len(self.view_model.model.overlay_write_errors)
+                if write_error_count:
+                    status += f"  |   {write_error_count} overlay writes failed"
+                watch_error_count = len(self.view_model.model.watch_errors)
+                if watch_error_count:
+                    status += f"  |   {watch_error_count} watched files failed"
             else:
                 status = "No folder loaded"
 
@@ -109,25 +214,50 @@ class MainView:
         self.view_model.reset_clicked_points()
         self.image_canvas.clear_canvas_elements()
 
-    def run_auto_detection(self, directory):
+    def run_auto_detection(self):
+        # Runs on a background thread, so progress and the outcome are handed to the Tk thread
         self.start_time = time.time()
-        self.view_model.load_directory(directory, self.update_progress)
+        try:
+            completed = self.view_model.run_auto_detection(
+                lambda progress: self.call_from_background(self.update_progress, progress)
+            )
+        except Exception as e:
+            # E.g. a circle diameter that does not fit the images
+            self.call_from_background(self.on_auto_detection_failed, e)
+            return
+        # Not completed if another folder was loaded meanwhile, which runs its own detection
+        if completed:
+            self.call_from_background(self.on_auto_detection_finished)
+
+    def on_auto_detection_finished(self):
         self.update_progress(100)
         self.next_image()
+        self.start_folder_watch()
 
-    def load_directory_without_auto_detection(self, directory):
-        try:
-            self.reset_view_state()
-            self.view_model.load_directory(directory)
-            self.finalize_directory_loading()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+    def on_auto_detection_failed(self, error):
+        messagebox.showerror("Error", f"Auto detection failed: {error}")
+        if self.view_model.is_folder_loaded():
+            self.update_status()
 
     def finalize_directory_loading(self):
         image = self.view_model.get_image_to_display()
         self.image_canvas.display_image(image)
         self.update_status()
 
+    def start_folder_watch(self):
+        if self.view_model.get_option("watch_folder"):
+            # Watcher callbacks arrive on a background thread; hand them to the Tk event loop
+            self.view_model.start_watching(lambda filename: self.call_from_background(self.on_watched_file))
+
+    def on_file_index_update(self):
+        if self.view_model.is_folder_loaded():
+            self.update_status()
+
+    def on_watched_file(self):
+        if self.view_model.is_folder_loaded():
+            self.update_status()
+            self.update_image_info()
+
     def update_progress(self, progress):
         current_time = time.time()
         elapsed_time = current_time - self.start_time
@@ -12,31 +12,41 @@ class ImageCanvas(Canvas):
         self.line_on_canvas = None
         self.current_image = None
         self.center_oval = None
-        self.red_dots = []  # List to keep track of red dots
+        self.red_dot = None
+        # Images arrive as screen-sized previews; this converts full-resolution pixels to canvas pixels
+        self.display_scale = 1.0
+        self.view_model.display_size = (self.winfo_screenwidth(), self.winfo_screenheight())
 
     def display_image(self, image):
+        full_width, full_height = image.info.get("full_size", image.size)
+        self.display_scale = image.width / full_width
         self.current_image = ImageTk.PhotoImage(image)
-        image_width = self.current_image.width()
-        image_height = self.current_image.height()
         if self.image_on_canvas:
             self.itemconfig(self.image_on_canvas, image=self.current_image)
         else:
             self.image_on_canvas = self.create_image(0, 0, anchor="nw", image=self.current_image)
-        self.display_center_circle(image_width, image_height)
+            self.tag_lower(self.image_on_canvas)
+        self.display_center_circle(full_width, full_height, self.view_model.get_option("circle_diameter"))
 
-    def display_center_circle(self, width, height, diameter=236):
+    def to_canvas_coordinates(self, x, y):
+        return x * self.display_scale, y * self.display_scale
+
+    def to_image_coordinates(self, x, y):
+        return round(x / self.display_scale), round(y / self.display_scale)
+
+    def display_center_circle(self, width, height, diameter):
         # Calculate the center coordinates
         center_x, center_y = width // 2, height // 2
-        # Calculate the top-left and bottom-right coordinates of the circle
-        top_left_x = center_x - diameter // 2
-        top_left_y = center_y - diameter // 2
-        bottom_right_x = center_x + diameter // 2
-        bottom_right_y = center_y + diameter // 2
-        # Create the circle
-        self.center_oval = self.create_oval(top_left_x, top_left_y, bottom_right_x, bottom_right_y, outline='green')
+        # Calculate the top-left and bottom-right coordinates of the circle on the canvas
+        top_left = self.to_canvas_coordinates(center_x - diameter // 2, center_y - diameter // 2)
+        bottom_right = self.to_canvas_coordinates(center_x + diameter // 2, center_y + diameter // 2)
+        if self.center_oval:
+            self.coords(self.center_oval, *top_left, *bottom_right)
+        else:
+            self.center_oval = self.create_oval(*top_left, *bottom_right, outline='green')
 
     def on_canvas_click(self, event):
-        new_image = self.image_click_callback(event.x, event.y)
+        new_image = self.image_click_callback(*self.to_image_coordinates(event.x, event.y))
         if new_image:
             self.display_image(new_image)
             self.clear_canvas_elements()
@@ -49,22 +59,27 @@ class ImageCanvas(Canvas):
 
     def update_line_to_mouse(self, event):
         if len(self.view_model.clicked_points) == 1:
+            start_x, start_y = self.to_canvas_coordinates(*self.view_model.clicked_points[0])
             if self.line_on_canvas:
-                self.coords(self.line_on_canvas, *self.view_model.clicked_points[0], event.x, event.y)
+                self.coords(self.line_on_canvas, start_x, start_y, event.x, event.y)
+                self.itemconfig(self.line_on_canvas, state='normal')
             else:
-                self.line_on_canvas = self.create_line(*self.view_model.clicked_points[0], event.x, event.y, fill='red')
+                self.line_on_canvas = self.create_line(start_x, start_y, event.x, event.y, fill='red')
 
     def display_red_dot(self, x, y):
-        red_dot = self.create_oval(x - 3, y - 3, x + 3, y + 3, fill='red', outline='red')
-        self.red_dots.append(red_dot)
+        x, y = self.to_canvas_coordinates(x, y)
+        if self.red_dot:
+            self.coords(self.red_dot, x - 3, y - 3, x + 3, y + 3)
+            self.itemconfig(self.red_dot, state='normal')
+        else:
+            self.red_dot = self.create_oval(x - 3, y - 3, x + 3, y + 3, fill='red', outline='red')
 
     def clear_canvas_elements(self):
+        # The line and dot are hidden rather than deleted so the next manual line reuses them
         if self.line_on_canvas:
-            self.delete(self.line_on_canvas)
-            self.line_on_canvas = None
-        for dot in self.red_dots:
-            self.delete(dot)
-        self.red_dots.clear()
+            self.itemconfig(self.line_on_canvas, state='hidden')
+        if self.red_dot:
+            self.itemconfig(self.red_dot, state='hidden')
         self.unbind("<Motion>")
 
     def clear_image_set(self):
@@ -1,4 +1,6 @@
-from tkinter import Toplevel, Label, Entry, Button, Checkbutton, BooleanVar, StringVar, filedialog, Frame
+from tkinter import (
+    Toplevel, Label, Entry, Button, Checkbutton, BooleanVar, StringVar, filedialog, Frame, OptionMenu, messagebox
+)
 
 
 class SettingsPopupComponent:
@@ -12,6 +14,11 @@ class SettingsPopupComponent:
         self.export_to_excel_var = BooleanVar(value=self.view_model.get_option("export_to_excel"))
         self.export_to_mat_var = BooleanVar(value=self.view_model.get_option("export_to_mat"))
         self.run_auto_detection_var = BooleanVar(value=self.view_model.get_option("run_auto_detection"))
+        self.use_result_cache_var = BooleanVar(value=self.view_model.get_option("use_result_cache"))
+        self.use_frame_cache_var = BooleanVar(value=self.view_model.get_option("use_frame_cache"))
+        self.watch_folder_var = BooleanVar(value=self.view_model.get_option("watch_folder"))
+        self.profile_analysis_var = BooleanVar(value=self.view_model.get_option("profile_analysis"))
+        self.multiscale_detection_var = BooleanVar(value=self.view_model.get_option("detection_mode") == "multiscale")
 
         # Auto Detection Checkbox
         auto_detect_frame = Frame(self.top)
@@ -19,6 +26,35 @@ class SettingsPopupComponent:
         self.run_auto_detection_button = Checkbutton(auto_detect_frame, text="Run auto detection",
                                                      variable=self.run_auto_detection_var)
         self.run_auto_detection_button.pack(side='left')
+        self.use_result_cache_button = Checkbutton(auto_detect_frame, text="Use result cache",
+                                                   variable=self.use_result_cache_var)
+        self.use_result_cache_button.pack(side='left')
+        self.use_frame_cache_button = Checkbutton(auto_detect_frame, text="Cache decoded frames",
+                                                  variable=self.use_frame_cache_var)
+        self.use_frame_cache_button.pack(side='left')
+        self.watch_folder_button = Checkbutton(auto_detect_frame, text="Watch folder for new images",
+                                               variable=self.watch_folder_var)
+        self.watch_folder_button.pack(side='left')
+        self.profile_analysis_button = Checkbutton(auto_detect_frame, text="Profile analysis",
+                                                   variable=self.profile_analysis_var)
+        self.profile_analysis_button.pack(side='left')
+        self.multiscale_detection_button = Checkbutton(auto_detect_frame, text="Multiscale line detection",
+                                                       variable=self.multiscale_detection_var)
+        self.multiscale_detection_button.pack(side='left')
+
+        # Segmentation Backend
+        segmentation_frame = Frame(self.top)
+        segmentation_frame.pack(fill='x', padx=10, pady=5)
+        self.segmentation_label = Label(segmentation_frame, text="Segmentation:")
+        self.segmentation_label.pack(side='left')
+        self.segmentation_var = StringVar(value=self.view_model.get_option("segmentation_backend"))
+        self.segmentation_menu = OptionMenu(segmentation_frame, self.segmentation_var, "kmeans", "otsu", "two_means")
+        self.segmentation_menu.pack(side='left', padx=5)
+        self.circle_diameter_label = Label(segmentation_frame, text="Circle diameter (px):")
+        self.circle_diameter_label.pack(side='left', padx=(10, 0))
+        self.circle_diameter_var = StringVar(value=str(self.view_model.get_option("circle_diameter")))
+        self.circle_diameter_entry = Entry(segmentation_frame, textvariable=self.circle_diameter_var, width=6)
+        self.circle_diameter_entry.pack(side='left', padx=5)
 
         # Export Options Checkboxes
         export_frame = Frame(self.top)
@@ -52,10 +88,27 @@ class SettingsPopupComponent:
             self.analysis_export_path_var.set(directory)
 
     def save_settings(self):
+        try:
+            circle_diameter = int(self.circle_diameter_var.get())
+            if circle_diameter < 2:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Invalid Setting", "The circle diameter must be a whole number of pixels, at least 2.",
+                                 parent=self.top)
+            return
+
         self.view_model.update_settings("export_to_csv", self.export_to_csv_var.get())
         self.view_model.update_settings("export_to_excel", self.export_to_excel_var.get())
         self.view_model.update_settings("export_to_mat", self.export_to_mat_var.get())
         self.view_model.update_settings("run_auto_detection", self.run_auto_detection_var.get())
+        self.view_model.update_settings("use_result_cache", self.use_result_cache_var.get())
+        self.view_model.update_settings("use_frame_cache", self.use_frame_cache_var.get())
+        self.view_model.update_settings("watch_folder", self.watch_folder_var.get())
+        self.view_model.update_settings("profile_analysis", self.profile_analysis_var.get())
+        self.view_model.update_settings("detection_mode",
+                                        "multiscale" if self.multiscale_detection_var.get() else "standard")
+        self.view_model.update_settings("segmentation_backend", self.segmentation_var.get())
+        self.view_model.update_settings("circle_diameter", circle_diameter)
         self.view_model.update_settings("analysis_export_path", self.analysis_export_path_var.get())
 
         self.top.destroy()
@@ -1,5 +1,6 @@
 import os
-from PIL import Image
+from functools import partial
+from .ImageCache import ImageCache, ImagePrefetcher, load_original_image, load_processed_image
 
 
 class DrawLineToolViewModel:
@@ -9,6 +10,14 @@ class DrawLineToolViewModel:
         self.is_displaying_original_image = False
         self.clicked_points = []
         self.is_object_lighter = False
+        self.image_cache = ImageCache(self.model.settings.get_option("image_cache_memory_mb") * 1024 * 1024)
+        self.image_prefetcher = ImagePrefetcher(self.image_cache)
+        # Set by the view; images are then cached and shown downsampled to fit within this size
+        self.display_size = None
+        # Set by the view; called with (filename, error) from a worker thread when a drawn line has been analysed
+        self.analysis_done_callback = None
+        # Set by the view; called from the indexing thread as the files of a folder are found and once they are sorted
+        self.file_index_callback = None
 
     def get_current_file_name(self):
         return self.model.get_current_file()
@@ -18,21 +27,62 @@ class DrawLineToolViewModel:
 
     def get_image_to_display(self, force_to_display_original=False):
         if not force_to_display_original:
-            original_filename = self.model.get_current_file()  # The original file name
-            processed_filename = f"{os.path.splitext(original_filename)[0]}_processed.jpg"
-            if processed_filename in os.listdir(self.model.output_processed_folder):
-                image = Image.open(f"{self.model.output_processed_folder}/{processed_filename}")
-                return image
+            processed_image = self.model.get_processed_image(self.model.get_current_file())
+            if processed_image is not None:
+                processed_path, mtime = processed_image
+                return self.image_cache.get(*self.get_image_request(processed_path, "processed", mtime))
 
         self.is_displaying_original_image = True
-        return self.model.get_current_image()
-
-    def load_directory(self, directory, progress_callback=None):
-        self.model.load_directory(directory, progress_callback)
+        original_path = os.path.join(self.model.current_dir, self.model.get_current_file())
+        return self.image_cache.get(*self.get_image_request(original_path, "original"))
+
+    def get_image_request(self, path, variant, mtime=None):
+        loader = load_processed_image if variant == "processed" else load_original_image
+        if self.display_size is not None:
+            # Only the display uses these previews; the analysis reads the full-resolution file itself
+            loader = partial(loader, max_size=self.display_size)
+        return path, (variant, self.display_size), loader, mtime
+
+    def prefetch_neighbours(self, direction):
+        prefetch_count = self.model.settings.get_option("image_prefetch_count")
+        # The list and position are swapped together on the index scan thread once the folder is sorted
+        with self.model.file_index_lock:
+            files, current_file_index = self.model.files, self.model.current_file_index
+        number_of_files = len(files)
+        if not prefetch_count or number_of_files < 2:
+            return
+
+        # Images ahead in the direction of travel first, then the ones just left behind
+        offsets = [direction * step for step in range(1, prefetch_count + 1)]
+        offsets += [-direction * step for step in range(1, prefetch_count + 1)]
+        requests = []
+        for offset in offsets:
+            filename = files[(current_file_index + offset) % number_of_files]
+            processed_image = self.model.get_processed_image(filename)
+            if processed_image is not None:
+                processed_path, mtime = processed_image
+                requests.append(self.get_image_request(processed_path, "processed", mtime))
+            else:
+                original_path = os.path.join(self.model.current_dir, filename)
+                requests.append(self.get_image_request(original_path, "original"))
+        self.image_prefetcher.prefetch(requests)
+
+    def open_directory(self, directory):
+        self.image_cache.clear()
+        self.model.open_directory(directory, self.file_index_callback)
         self.folder_loaded = True
         self.is_object_lighter = False
         return self.get_image_to_display()
 
+    def run_auto_detection(self, progress_callback=None):
+        return self.model.run_auto_detection(progress_callback)
+
+    def is_file_index_complete(self):
+        return self.model.is_file_index_complete()
+
+    def start_watching(self, change_callback=None):
+        self.model.start_watching(change_callback)
+
     def is_folder_loaded(self):
         return self.folder_loaded
 
@@ -41,14 +91,18 @@ class DrawLineToolViewModel:
         if not self.model.settings.get_option("run_auto_detection"):
             self.is_displaying_original_image = False
         self.is_object_lighter = False
-        return self.get_image_to_display()
+        image = self.get_image_to_display()
+        self.prefetch_neighbours(1)
+        return image
 
     def cycle_previous_file(self):
         self.model.cycle_previous_file()
         if not self.model.settings.get_option("run_auto_detection"):
             self.is_displaying_original_image = False
         self.is_object_lighter = False
-        return self.get_image_to_display()
+        image = self.get_image_to_display()
+        self.prefetch_neighbours(-1)
+        return image
 
     def update_settings(self, option, value):
         self.model.settings.update_option(option, value)
@@ -65,7 +119,10 @@ class DrawLineToolViewModel:
             if len(self.clicked_points) < 2:
                 self.clicked_points.append((x, y))
                 if len(self.clicked_points) == 2:
-                    self.model.get_analysis_for_current_image(self.clicked_points, self.is_object_lighter)
+                    # The analysis runs in the background, so the next image is shown straight away
+                    self.model.submit_analysis_for_current_image(
+                        self.clicked_points, self.is_object_lighter, self.analysis_done_callback
+                    )
                     self.clicked_points.clear()
                     self.is_displaying_original_image = False
                     self.is_object_lighter = False
@@ -73,6 +130,13 @@ class DrawLineToolViewModel:
             return None
 
     def get_current_image_info(self):
+        if self.model.is_analysis_pending(self.model.get_current_file()):
+            return {
+                'angle': None,
+                'contrast': None,
+                'blurriness': None,
+                'pending': True
+            }
         if self.model.get_current_file() not in self.model.analysis:
             return {
                 'angle': None,
@@ -82,11 +146,23 @@ class DrawLineToolViewModel:
 
         return self.model.analysis[self.model.get_current_file()]
 
+    def reanalyse_annotations(self, progress_callback=None):
+        results = self.model.reanalyse_annotations(progress_callback=progress_callback)
+        self.image_cache.clear()
+        return results
+
+    def get_result_cache_stats(self):
+        return self.model.get_result_cache_stats()
+
+    def get_stage_timing_status(self):
+        return self.model.get_stage_timing_status()
+
     def reset_clicked_points(self):
         self.is_displaying_original_image = False
         self.clicked_points.clear()
 
     def reset_state(self):
+        self.image_cache.clear()
         self.folder_loaded = False
         self.is_displaying_original_image = False
         self.clicked_points.clear()
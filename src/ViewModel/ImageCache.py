@@ -0,0 +1,90 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from Model.ImageAnalysis.ImageHandle import ImageHandle
+
+
+def load_original_image(path, max_size=None):
+    return ImageHandle(path).get_preview(max_size, "L")
+
+
+def load_processed_image(path, max_size=None):
+    return ImageHandle(path).get_preview(max_size, "RGB")
+
+
+def get_image_size_in_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class ImageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, variant, loader, mtime=None):
+        key = (path, variant)
+        # The processed variant is rewritten after a manual analysis, so entries are tied to the file's mtime
+        if mtime is None:
+            mtime = os.path.getmtime(path)
+        with self.lock:
+            entry = self.images.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.images.move_to_end(key)
+                return entry[1]
+
+        image = loader(path)
+        self.put(key, mtime, image)
+        return image
+
+    def put(self, key, mtime, image):
+        size = get_image_size_in_bytes(image)
+        with self.lock:
+            self.discard(key)
+            if size > self.max_bytes:
+                return
+            self.images[key] = (mtime, image, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.images.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def discard(self, key):
+        entry = self.images.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def invalidate(self, path, variant):
+        with self.lock:
+            self.discard((path, variant))
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.current_bytes = 0
+
+
+class ImagePrefetcher:
+    def __init__(self, image_cache):
+        self.image_cache = image_cache
+        self.requests = queue.Queue()
+        self.generation = 0
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def prefetch(self, requests):
+        # Requests queued for an earlier position are skipped once the user has moved on
+        self.generation += 1
+        for path, variant, loader, mtime in requests:
+            self.requests.put((self.generation, path, variant, loader, mtime))
+
+    def run(self):
+        while True:
+            generation, path, variant, loader, mtime = self.requests.get()
+            if generation != self.generation:
+                continue
+            try:
+                self.image_cache.get(path, variant, loader, mtime)
+            except OSError:
+                pass